@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta
 import math
+import sys
 import requests
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
 from Core import Camera, Location, db
 import pytz
 
@@ -12,6 +14,9 @@ class Analytics(Model):
     
     class Meta:
         database = db
+        indexes = (
+            (('cameraId', 'timestamp'), True),
+        )
         
 class Frames(Model):
     cameraId = ForeignKeyField(Camera, backref='id')
@@ -20,76 +25,380 @@ class Frames(Model):
     frameStart = TimeField()
     low = IntegerField()
     high = IntegerField()
-    average = IntegerField()
+    average = FloatField()
+    # Running totals so mean and standard deviation can be updated in O(1)
+    n = IntegerField(default=0)
+    sum = IntegerField(default=0)
+    sumSq = IntegerField(default=0)
     
     class Meta:
         database = db
+        indexes = (
+            (('cameraId', 'weekday', 'summer', 'frameStart'), True),
+            (('cameraId', 'weekday', 'frameStart'), False),
+        )
+
+class HourlyAnalytics(Model):
+    # The API camera id, like Analytics.cameraId stores
+    cameraId = IntegerField()
+    # Start of the period in Arizona local time
+    periodStart = DateTimeField()
+    low = IntegerField()
+    high = IntegerField()
+    average = FloatField()
+    n = IntegerField(default=0)
+    sum = IntegerField(default=0)
+    sumSq = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('cameraId', 'periodStart'), True),
+        )
+
+class DailyAnalytics(HourlyAnalytics):
+    pass
+
+# Raw Analytics rows older than this are deleted once they are covered by the rollups
+RAW_RETENTION_DAYS = 90
+# Hourly rollups older than this are deleted; daily rollups are kept forever
+HOURLY_RETENTION_DAYS = 730
 
 ARIZONA_TZ = pytz.timezone('America/Phoenix')
 
-def frameStart(date_string: str, interval_minutes=30) -> datetime:
-    current_time = datetime.fromisoformat(date_string)
+def localTime(timestamp) -> datetime:
+    """Parse an API timestamp (assumed UTC when naive) into Arizona time."""
+    current_time = timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp)
     if current_time.tzinfo is None:
         current_time = current_time.replace(tzinfo=pytz.utc)
-    current_time = current_time.astimezone(ARIZONA_TZ)
+    return current_time.astimezone(ARIZONA_TZ)
+
+def frameStart(date_string: str, interval_minutes=30) -> datetime:
+    current_time = localTime(date_string)
     total_minutes = current_time.hour * 60 + current_time.minute
     rounded_minutes = (total_minutes // interval_minutes) * interval_minutes
     frame_start_time = current_time.replace(hour=rounded_minutes // 60, minute=rounded_minutes % 60, second=0, microsecond=0)
     return frame_start_time
 
 def weekday(timestamp: str) -> str:
-    dt = datetime.fromisoformat(timestamp).replace(tzinfo=pytz.utc).astimezone(ARIZONA_TZ)
-    return dt.strftime('%A')
+    return localTime(timestamp).strftime('%A')
 
 def isSummer(timestamp: str) -> bool:
-    dt = datetime.fromisoformat(timestamp).replace(tzinfo=pytz.utc).astimezone(ARIZONA_TZ)
-    return 5 <= dt.month <= 8
+    return 5 <= localTime(timestamp).month <= 8
+
+def frameKey(camera_id, timestamp):
+    """(cameraId, weekday, summer, frameStart) for a sample, parsing the timestamp once."""
+    current_time = localTime(timestamp)
+    return (camera_id, weekday(current_time), str(isSummer(current_time)), frameStart(current_time).time())
+
+def frameStats(frame):
+    """Mean and population standard deviation of a frame's samples."""
+    if not frame['n']:
+        return 0.0, 0.0
+    mean = frame['sum'] / frame['n']
+    variance = max(frame['sumSq'] / frame['n'] - mean * mean, 0.0)
+    return mean, math.sqrt(variance)
+
+def locationFrames(camera_ids, weekday, limit=200):
+    """A location's Frames for one weekday, its cameras combined into one row per (summer, frameStart).
+
+    Averages add across cameras, and so do variances (cameras treated as independent).
+    low and high are the sums of each camera's extremes, which bound the location's total.
+    """
+    rows = {}
+    frames = Frames.select().where(Frames.cameraId.in_(list(camera_ids)) & (Frames.weekday == weekday)).dicts()
+    for frame in frames:
+        mean, stddev = frameStats(frame)
+        key = (frame['summer'], frame['frameStart'])
+        row = rows.setdefault(key, {'weekday': weekday, 'summer': key[0], 'frameStart': key[1], 'low': 0, 'high': 0,
+                                    'average': 0.0, 'variance': 0.0, 'n': 0, 'cameras': 0})
+        row['low'] += frame['low']
+        row['high'] += frame['high']
+        row['average'] += mean
+        row['variance'] += stddev * stddev
+        row['n'] += frame['n']
+        row['cameras'] += 1
+    combined = sorted(rows.values(), key=lambda row: row['frameStart'], reverse=True)[:limit]
+    for row in combined:
+        row['stddev'] = math.sqrt(row.pop('variance'))
+    return combined
+
+def addSample(rows, key, base, count):
+    """Fold one count into the running-total row for key, starting it from base if it is new."""
+    row = rows.get(key)
+    if row is None:
+        rows[key] = dict(base, low=count, high=count, average=count, n=1, sum=count, sumSq=count * count)
+        return
+    row['low'] = min(row['low'], count)
+    row['high'] = max(row['high'], count)
+    row['n'] += 1
+    row['sum'] += count
+    row['sumSq'] += count * count
+    row['average'] = row['sum'] / row['n']
+
+def frameRows(samples):
+    """Collapse (cameraId, timestamp, peopleCount) samples into one Frames row per frame."""
+    rows = {}
+    for camera_id, timestamp, count in samples:
+        key = frameKey(camera_id, timestamp)
+        addSample(rows, key, {'cameraId': key[0], 'weekday': key[1], 'summer': key[2], 'frameStart': key[3]}, count)
+    return list(rows.values())
+
+def rollupRows(samples):
+    """Collapse samples into (hourly rows, daily rows) keyed on Arizona local periods."""
+    hourly, daily = {}, {}
+    for camera_id, timestamp, count in samples:
+        current_time = localTime(timestamp).replace(tzinfo=None)
+        hour = current_time.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        addSample(hourly, (camera_id, hour), {'cameraId': camera_id, 'periodStart': hour}, count)
+        addSample(daily, (camera_id, day), {'cameraId': camera_id, 'periodStart': day}, count)
+    return list(hourly.values()), list(daily.values())
+
+def upsertRunning(model, conflict_target, rows, batch_size=100):
+    """Merge running-total rows into model, adding to the totals of rows that already exist."""
+    for batch in chunked(rows, batch_size):
+        (model
+         .insert_many(batch)
+         .on_conflict(
+             conflict_target=conflict_target,
+             update={
+                 model.low: fn.MIN(model.low, EXCLUDED.low),
+                 model.high: fn.MAX(model.high, EXCLUDED.high),
+                 model.n: model.n + EXCLUDED.n,
+                 model.sum: model.sum + EXCLUDED.sum,
+                 model.sumSq: model.sumSq + EXCLUDED.sumSq,
+                 model.average: (model.sum + EXCLUDED.sum) * 1.0 / (model.n + EXCLUDED.n),
+             })
+         .execute())
+    return len(rows)
+
+def upsertFrames(rows, batch_size=100):
+    return upsertRunning(Frames, [Frames.cameraId, Frames.weekday, Frames.summer, Frames.frameStart], rows, batch_size)
+
+def upsertRollups(samples, batch_size=100):
+    """Add samples to the hourly and daily rollups. Returns the number of rollup rows touched."""
+    hourly, daily = rollupRows(samples)
+    return (upsertRunning(HourlyAnalytics, [HourlyAnalytics.cameraId, HourlyAnalytics.periodStart], hourly, batch_size) +
+            upsertRunning(DailyAnalytics, [DailyAnalytics.cameraId, DailyAnalytics.periodStart], daily, batch_size))
+
+def addCorrection(rows, key, base, old, new):
+    """Fold the change of one sample from old to new into the correction row for key."""
+    row = rows.setdefault(key, dict(base, low=new, high=new, average=0.0, n=0, sum=0, sumSq=0))
+    row['low'] = min(row['low'], new)
+    row['high'] = max(row['high'], new)
+    row['sum'] += new - old
+    row['sumSq'] += new * new - old * old
 
-def updateFrame(data, frames):
+def replaceSamples(changes, batch_size=100):
+    """Rewrite stored Analytics counts and shift Frames and the rollups by the difference.
+
+    changes are (cameraId, timestamp, oldCount, newCount) for samples that are still
+    stored. Sample counts, means and spreads stay exact; low and high can only widen,
+    because an old extreme cannot be taken back out of a running total.
+    """
+    frames, hourly, daily = {}, {}, {}
+    for camera_id, timestamp, old, new in changes:
+        Analytics.update(peopleCount=new).where((Analytics.cameraId == camera_id) &
+                                                (Analytics.timestamp == timestamp)).execute()
+        key = frameKey(camera_id, timestamp)
+        addCorrection(frames, key, {'cameraId': key[0], 'weekday': key[1], 'summer': key[2], 'frameStart': key[3]},
+                      old, new)
+        hour = localTime(timestamp).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+        addCorrection(hourly, (camera_id, hour), {'cameraId': camera_id, 'periodStart': hour}, old, new)
+        day = hour.replace(hour=0)
+        addCorrection(daily, (camera_id, day), {'cameraId': camera_id, 'periodStart': day}, old, new)
+    # With n = 0 the running-total upsert adds the differences and keeps every sample count
+    upsertFrames(list(frames.values()), batch_size)
+    upsertRunning(HourlyAnalytics, [HourlyAnalytics.cameraId, HourlyAnalytics.periodStart], list(hourly.values()),
+                  batch_size)
+    upsertRunning(DailyAnalytics, [DailyAnalytics.cameraId, DailyAnalytics.periodStart], list(daily.values()),
+                  batch_size)
+    return len(changes)
+
+def insertAnalytics(rows, batch_size=100):
+    """Insert Analytics rows, letting the unique (cameraId, timestamp) index drop duplicates.
+
+    Returns the (cameraId, timestamp, peopleCount) samples that were actually inserted.
+    """
+    inserted = []
+    for batch in chunked(rows, batch_size):
+        inserted.extend(Analytics
+                        .insert_many(batch)
+                        .on_conflict_ignore()
+                        .returning(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+                        .tuples()
+                        .execute())
+    return inserted
+
+def migrateFrames():
+    """Add the running-total columns to a Frames table created before they existed.
+
+    Returns True when columns were added, meaning the frames need rebuildFrames().
+    """
+    columns = {column.name for column in db.get_columns('frames')}
+    migrator = SqliteMigrator(db)
+    operations = [migrator.add_column('frames', name, field)
+                  for name, field in (('n', Frames.n), ('sum', Frames.sum), ('sumSq', Frames.sumSq))
+                  if name not in columns]
+    if operations:
+        migrate(*operations)
+    return bool(operations)
+
+def compactedSamples(model):
+    """Samples counted in a Frames or rollup table whose raw Analytics rows were since compacted away."""
+    counted = model.select(fn.COALESCE(fn.SUM(model.n), 0)).scalar()
+    return max(counted - Analytics.select().count(), 0)
+
+def rebuildFrames(batch_size=500):
+    """Rebuild every Frames row from the Analytics table in one streaming pass.
+
+    Frames mix samples from every week, so they cannot be rebuilt in part. Once
+    compaction has dropped raw rows they are left as they are.
+    """
+    with db.connection_context():
+        migrateFrames()
+        compacted = compactedSamples(Frames)
+        if compacted:
+            print(f"Not rebuilding frames: {compacted} of their samples were compacted out of Analytics")
+            return 0
+        samples = (Analytics
+                   .select(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+                   .order_by(Analytics.cameraId, Analytics.timestamp)
+                   .tuples()
+                   .iterator())
+
+        def unique(samples):
+            previous = None
+            for sample in samples:
+                if sample[:2] != previous:
+                    yield sample
+                previous = sample[:2]
+
+        rows = frameRows(unique(samples))
+        with db.atomic():
+            Frames.delete().execute()
+            for batch in chunked(rows, batch_size):
+                Frames.insert_many(batch).execute()
+            Frames._schema.create_indexes(safe=True)
+    print(f"Rebuilt {len(rows)} frames from Analytics")
+    return len(rows)
+
+def rebuildRollups(batch_size=500, raw_days=RAW_RETENTION_DAYS):
+    """Rebuild the hourly and daily rollups from the raw Analytics rows still stored.
+
+    Once compaction has dropped raw rows, only the days inside the retention window
+    are rebuilt; older rollups are the only record left of their samples and are kept.
+    """
     with db.connection_context():
-        for frame in frames:
-            if data['peopleCount'] > frame.high:
-                frame.high = data['peopleCount']
-            elif data['peopleCount'] < frame.low:
-                frame.low = data['peopleCount']
-            frame.average = (frame.average + data['peopleCount']) / 2
-            frame.save()
-
-def pushAnalytics(data):  
+        samples = Analytics.select(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+        since = None
+        if compactedSamples(DailyAnalytics) or compactedSamples(HourlyAnalytics):
+            # First local midnight after the retention cutoff: every day from there on is complete
+            cutoff = localTime(datetime.now(pytz.utc) - timedelta(days=raw_days))
+            since = ARIZONA_TZ.localize(datetime(cutoff.year, cutoff.month, cutoff.day)) + timedelta(days=1)
+            samples = samples.where(Analytics.timestamp >= utcTimestamp(since))
+            since = since.replace(tzinfo=None)
+        hourly, daily = rollupRows(samples.tuples().iterator())
+        with db.atomic():
+            for model, rows in ((HourlyAnalytics, hourly), (DailyAnalytics, daily)):
+                delete = model.delete()
+                if since is not None:
+                    delete = delete.where(model.periodStart >= since)
+                delete.execute()
+                for batch in chunked(rows, batch_size):
+                    model.insert_many(batch).execute()
+    print(f"Rebuilt {len(hourly)} hourly and {len(daily)} daily rollups from Analytics"
+          + (f" since {since.date()}" if since else ""))
+    return len(hourly) + len(daily)
+
+def utcTimestamp(moment: datetime) -> str:
+    """Format an aware datetime the way the API's updated_at values are stored."""
+    return moment.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def compactAnalytics(raw_days=RAW_RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS):
+    """Drop raw rows and hourly rollups past their retention window.
+
+    Raw rows are already folded into the rollups as they are written. The newest row
+    per camera is always kept so a camera whose updated_at stops moving is not counted
+    again. Afterwards rebuildFrames leaves Frames alone and rebuildRollups only
+    rebuilds the days inside the retention window.
+    """
+    now = datetime.now(pytz.utc)
+    newest = Analytics.select(fn.MAX(Analytics.id)).group_by(Analytics.cameraId)
     with db.connection_context():
-        existing_point = Analytics.get_or_none(
-            (Analytics.cameraId == data['id']) & 
-            (Analytics.timestamp == data['timestamp'])
-        )
-        if existing_point is None:
-            Analytics.create(
-                cameraId=data['id'], 
-                timestamp=data['timestamp'], 
-                peopleCount=data['peopleCount']
-            )
-        else:
-            print(f"Skipping duplicate entry for camera {data['id']} at {data['timestamp']}")
-            
-def pushFrame(data):
-    # Materialize the query result while the connection is open
+        with db.atomic():
+            raw = (Analytics
+                   .delete()
+                   .where((Analytics.timestamp < utcTimestamp(now - timedelta(days=raw_days))) &
+                          (Analytics.id.not_in(newest)))
+                   .execute())
+            cutoff = localTime(now - timedelta(days=hourly_days)).replace(tzinfo=None)
+            hourly = HourlyAnalytics.delete().where(HourlyAnalytics.periodStart < cutoff).execute()
+    if raw or hourly:
+        print(f"Compacted {raw} analytics rows and {hourly} hourly rollups")
+    return raw + hourly
+
+# Width of each history resolution in seconds, finest first
+RESOLUTIONS = {'raw': 0, 'hour': 3600, 'day': 86400}
+
+def pickResolution(start: datetime, end: datetime, resolution='auto') -> str:
+    """Choose the coarsest table that still gives the requested resolution.
+
+    'auto' picks by range length. Raw rows and hourly rollups are only used while the
+    range starts inside their retention window; older ranges fall back to the next
+    coarser table.
+    """
+    if resolution == 'auto':
+        span = end - start
+        resolution = 'raw' if span <= timedelta(days=2) else 'hour' if span <= timedelta(days=60) else 'day'
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution {resolution}")
+    now = datetime.now(pytz.utc)
+    if resolution == 'raw' and start < now - timedelta(days=RAW_RETENTION_DAYS):
+        resolution = 'hour'
+    if resolution == 'hour' and start < now - timedelta(days=HOURLY_RETENTION_DAYS):
+        resolution = 'day'
+    return resolution
+
+def history(camera_ids, start: datetime, end: datetime, resolution='auto'):
+    """Counts for the cameras between two aware datetimes as (resolution, points)."""
+    resolution = pickResolution(start, end, resolution)
     with db.connection_context():
-        frames = list(Frames.select().where(
-            (Frames.cameraId == data['id']) &
-            (Frames.frameStart == frameStart(data['timestamp'])) &
-            (Frames.summer == isSummer(data['timestamp'])) &
-            (Frames.weekday == weekday(data['timestamp']))
-        ))
-    
-    if frames:
-        updateFrame(data, frames)
+        if resolution == 'raw':
+            rows = (Analytics
+                    .select(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+                    .where(Analytics.cameraId.in_(camera_ids) &
+                           (Analytics.timestamp >= utcTimestamp(start)) &
+                           (Analytics.timestamp < utcTimestamp(end)))
+                    .order_by(Analytics.timestamp)
+                    .tuples())
+            points = [{
+                'cameraId': camera_id,
+                'periodStart': localTime(timestamp).replace(tzinfo=None).isoformat(),
+                'average': count, 'low': count, 'high': count, 'n': 1
+            } for camera_id, timestamp, count in rows]
+            return resolution, points
+
+        model = HourlyAnalytics if resolution == 'hour' else DailyAnalytics
+        rows = (model
+                .select(model.cameraId, model.periodStart, model.average, model.low, model.high, model.n)
+                .where(model.cameraId.in_(camera_ids) &
+                       (model.periodStart >= localTime(start).replace(tzinfo=None)) &
+                       (model.periodStart < localTime(end).replace(tzinfo=None)))
+                .order_by(model.periodStart)
+                .dicts())
+        points = []
+        for row in rows:
+            row['periodStart'] = row['periodStart'].isoformat()
+            points.append(row)
+        return resolution, points
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['backfill']:
+        rebuildFrames()
+        rebuildRollups()
+    elif sys.argv[1:] == ['compact']:
+        compactAnalytics()
     else:
-        with db.connection_context():
-            Frames.create(
-                cameraId=data['id'], 
-                weekday=weekday(data['timestamp']), 
-                frameStart=frameStart(data['timestamp']),
-                summer=isSummer(data['timestamp']),
-                high=data['peopleCount'],
-                low=data['peopleCount'],
-                average=data['peopleCount']
-            )
+        print("Usage: python Analytics.py backfill|compact")
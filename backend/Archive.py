@@ -0,0 +1,181 @@
+"""Append-only archive of raw camera JPEGs, and replay of archived frames through the detector.
+
+Each Arizona-local day has a pack file holding the JPEG bytes back to back and an
+index with one line per frame: cameraId, timestamp, offset and length, tab separated.
+Bytes are written before their index line, so the index never points past the data.
+
+Replay re-counts archived frames with the current model and DETECT_THRESHOLD and
+rewrites the matching Analytics samples, Frames and rollups:
+
+    python Archive.py replay 2025-02-10 2025-02-22 [--workers 4] [--threshold 0.15]
+"""
+import os
+import argparse
+import threading
+from itertools import islice
+from datetime import date, datetime, timedelta
+from Analytics import localTime, utcTimestamp, ARIZONA_TZ
+
+# Archive every downloaded frame during sweeps (off unless ARCHIVE_FRAMES=1)
+ARCHIVE_FRAMES = os.environ.get('ARCHIVE_FRAMES') == '1'
+ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH', './archive')
+
+class FrameArchive:
+    """Writes and reads the per-day pack files under ARCHIVE_PATH."""
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.last = {}
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def files(self, day):
+        name = os.path.join(self.path, day.isoformat())
+        return f"{name}.pack", f"{name}.idx"
+
+    def append(self, camera_id, timestamp, content):
+        """Archive one frame. A camera whose updated_at has not moved is only stored once."""
+        with self.lock:
+            if self.last.get(camera_id) == timestamp:
+                return False
+            pack, index = self.files(localTime(timestamp).date())
+            with open(pack, 'ab') as f:
+                offset = f.tell()
+                f.write(content)
+            with open(index, 'a') as f:
+                f.write(f"{camera_id}\t{timestamp}\t{offset}\t{len(content)}\n")
+            self.last[camera_id] = timestamp
+            return True
+
+    def entries(self, day):
+        """(cameraId, timestamp, offset, length) for every frame archived on a day."""
+        index = self.files(day)[1]
+        if not os.path.exists(index):
+            return
+        with open(index) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                # A line cut short by a crash is skipped
+                if len(fields) == 4 and fields[3].isdigit():
+                    yield int(fields[0]), fields[1], int(fields[2]), int(fields[3])
+
+    def read(self, day, entries):
+        """Yield (cameraId, timestamp, jpeg bytes) for index entries of a day, reading the pack in order."""
+        if not entries:
+            return
+        with open(self.files(day)[0], 'rb') as f:
+            for camera_id, timestamp, offset, length in sorted(entries, key=lambda entry: entry[2]):
+                f.seek(offset)
+                yield camera_id, timestamp, f.read(length)
+
+def replayDay(archive, day, detector, threshold, batch_size, decoder):
+    """Re-count one day's archived frames that still have an Analytics row.
+
+    Returns (changes, frames re-counted, frames skipped).
+    """
+    import cv2
+    import numpy as np
+    from Core import db
+    from Analytics import Analytics
+
+    start = ARIZONA_TZ.localize(datetime(day.year, day.month, day.day))
+    end = start + timedelta(days=1)
+    with db.connection_context():
+        stored = {(camera_id, timestamp): count for camera_id, timestamp, count in
+                  Analytics.select(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+                  .where((Analytics.timestamp >= utcTimestamp(start)) & (Analytics.timestamp < utcTimestamp(end)))
+                  .tuples()}
+
+    # Frames whose raw sample was compacted away cannot be corrected, since their old count is gone
+    seen = set()
+    entries = []
+    skipped = 0
+    for entry in archive.entries(day):
+        key = entry[:2]
+        if key in stored and key not in seen:
+            seen.add(key)
+            entries.append(entry)
+        else:
+            skipped += 1
+
+    def decode(frame):
+        camera_id, timestamp, content = frame
+        return camera_id, timestamp, cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    changes = []
+    pending = []
+
+    def collect(limit):
+        """Store finished batches, waiting for the oldest ones while more than limit are in flight."""
+        while pending and (len(pending) > limit or pending[0][1].done()):
+            keys, future = pending.pop(0)
+            for (camera_id, timestamp), (count, _) in zip(keys, future.result()):
+                old = stored[(camera_id, timestamp)]
+                if count != old:
+                    changes.append((camera_id, timestamp, old, count))
+
+    counted = 0
+    frames = archive.read(day, entries)
+    while True:
+        # Decode one batch at a time on the thread pool, so a day is never held in memory at once
+        chunk = list(islice(frames, batch_size))
+        if not chunk:
+            break
+        batch = [((camera_id, timestamp), image) for camera_id, timestamp, image in decoder.map(decode, chunk)
+                 if image is not None]
+        skipped += len(chunk) - len(batch)
+        counted += len(batch)
+        if batch:
+            pending.append(([key for key, _ in batch], detector.submit([image for _, image in batch], threshold)))
+        # Keep every worker busy, with a couple of batches queued behind each
+        collect(detector.workers * 2)
+    collect(0)
+    return changes, counted, skipped
+
+def replay(first, last, workers=None, threshold=None, batch_size=None, path=ARCHIVE_PATH):
+    """Re-count every archived frame from first to last (local dates, inclusive) and rewrite their samples."""
+    from concurrent.futures import ThreadPoolExecutor
+    from Core import db
+    from Analytics import replaceSamples
+    from Detect import DETECT_THRESHOLD, BATCH_SIZE
+    from DetectService import DetectionService, DETECT_WORKERS
+
+    threshold = DETECT_THRESHOLD if threshold is None else threshold
+    batch_size = batch_size or BATCH_SIZE
+    archive = FrameArchive(path)
+    detector = DetectionService(workers or DETECT_WORKERS, batch_size)
+    totals = {'frames': 0, 'changed': 0, 'skipped': 0}
+    try:
+        with ThreadPoolExecutor(max_workers=4) as decoder:
+            day = first
+            while day <= last:
+                changes, frames, skipped = replayDay(archive, day, detector, threshold, batch_size, decoder)
+                with db.connection_context():
+                    with db.atomic():
+                        replaceSamples(changes)
+                print(f"{day}: re-counted {frames} frames, {len(changes)} changed, {skipped} skipped")
+                totals['frames'] += frames
+                totals['changed'] += len(changes)
+                totals['skipped'] += skipped
+                day += timedelta(days=1)
+    finally:
+        detector.close()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('replay', help='re-count archived frames and rewrite their analytics')
+    command.add_argument('first', type=date.fromisoformat)
+    command.add_argument('last', type=date.fromisoformat)
+    command.add_argument('--workers', type=int, help='detector processes')
+    command.add_argument('--threshold', type=float, help='detection confidence (default DETECT_THRESHOLD)')
+    command.add_argument('--batch', type=int, help='frames per detector batch')
+    command.add_argument('--path', default=ARCHIVE_PATH)
+    args = parser.parse_args()
+    if args.first > args.last:
+        parser.error("first must not be after last")
+    print(replay(args.first, args.last, args.workers, args.threshold, args.batch, args.path))
+
+if __name__ == '__main__':
+    main()
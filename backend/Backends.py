@@ -0,0 +1,206 @@
+import os
+import sys
+import numpy as np
+import cv2
+from Detect import loadModel, MODEL_NAME
+
+# Which detector the workers run: torch, torchscript, onnx or int8
+DETECT_BACKEND = os.environ.get('DETECT_BACKEND', 'torch')
+# Square input resolution fed to the model
+INPUT_SIZE = int(os.environ.get('DETECT_INPUT_SIZE', 640))
+# Where exported models are written and read from
+MODELS_PATH = './models'
+# Same defaults as the YOLOv5 hub wrapper, so every backend filters alike. Callers pass
+# their own confidence, or anything below 0.25 would never reach the person filter.
+MODEL_CONFIDENCE = 0.25
+IOU_THRESHOLD = 0.45
+MAX_DETECTIONS = 1000
+
+def modelPath(backend, size=INPUT_SIZE):
+    """Path of the exported model file for a backend."""
+    suffix = {'torchscript': '.torchscript', 'onnx': '.onnx', 'int8': '-int8.onnx'}[backend]
+    return os.path.join(MODELS_PATH, f"{MODEL_NAME}-{size}{suffix}")
+
+def letterbox(image, size):
+    """Resize a frame to fit size x size, padding with gray. Returns (canvas, scale, left, top)."""
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_height, new_width = round(height * scale), round(width * scale)
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = (size - new_height) // 2, (size - new_width) // 2
+    canvas[top:top + new_height, left:left + new_width] = resized
+    return canvas, scale, left, top
+
+def preprocess(images, size):
+    """Letterbox BGR frames into one float32 RGB NCHW batch plus the layout of each frame."""
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    layouts = []
+    for i, image in enumerate(images):
+        canvas, scale, left, top = letterbox(image, size)
+        batch[i] = canvas[:, :, ::-1].transpose(2, 0, 1) / 255.0
+        layouts.append((image.shape[1], image.shape[0], scale, left, top))
+    return batch, layouts
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression; returns the indices of the boxes kept."""
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < MAX_DETECTIONS:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        overlap = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = overlap / (areas[best] + areas[rest] - overlap + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+def postprocess(output, layout, classes=None, confidence=MODEL_CONFIDENCE, iou_threshold=IOU_THRESHOLD):
+    """Turn one frame's raw YOLOv5 output (N x 85) into xyxyn rows: x1, y1, x2, y2, conf, class.
+
+    When classes is given, other classes are dropped before NMS.
+    """
+    width, height, scale, left, top = layout
+    scores = output[:, 5:] * output[:, 4:5]
+    if classes is not None:
+        # Only score the requested classes, so NMS has less to sort through
+        candidates = np.asarray(classes)
+        scores = scores[:, candidates]
+    best = scores.argmax(axis=1)
+    conf = scores[np.arange(len(scores)), best]
+    classes = candidates[best] if classes is not None else best
+    mask = conf >= confidence
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+    xywh, conf, classes = output[mask, :4], conf[mask], classes[mask]
+    boxes = np.empty_like(xywh)
+    boxes[:, 0] = (xywh[:, 0] - xywh[:, 2] / 2 - left) / scale / width
+    boxes[:, 1] = (xywh[:, 1] - xywh[:, 3] / 2 - top) / scale / height
+    boxes[:, 2] = (xywh[:, 0] + xywh[:, 2] / 2 - left) / scale / width
+    boxes[:, 3] = (xywh[:, 1] + xywh[:, 3] / 2 - top) / scale / height
+    boxes = boxes.clip(0, 1)
+    # Offset boxes per class so NMS never suppresses across classes
+    keep = nms(boxes + classes[:, None] * 2, conf, iou_threshold)
+    return np.concatenate([boxes[keep], conf[keep, None], classes[keep, None]], axis=1).astype(np.float32)
+
+class TorchDetector:
+    """The YOLOv5 hub model run eagerly in PyTorch (the original path)."""
+
+    def __init__(self, size=INPUT_SIZE, threads=None):
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.size = size
+        self.model = loadModel()
+        self.names = self.model.names
+
+    def predict(self, images, classes=None, confidence=MODEL_CONFIDENCE):
+        # Class and confidence filtering happen inside the hub wrapper's NMS
+        self.model.classes = classes
+        self.model.conf = confidence
+        # The hub wrapper expects RGB; cv2 decodes BGR
+        results = self.model([image[:, :, ::-1] for image in images], size=self.size)
+        return [prediction.cpu().numpy() for prediction in results.xyxyn]
+
+class TorchScriptDetector:
+    """A traced TorchScript export of the model, with our own pre- and post-processing."""
+
+    def __init__(self, size=INPUT_SIZE, threads=None, path=None):
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.size = size
+        self.model = torch.jit.load(path or modelPath('torchscript', size), map_location='cpu').eval()
+        self.names = COCO_NAMES
+
+    def predict(self, images, classes=None, confidence=MODEL_CONFIDENCE):
+        batch, layouts = preprocess(images, self.size)
+        with self.torch.no_grad():
+            output = self.model(self.torch.from_numpy(batch))
+        output = (output[0] if isinstance(output, (list, tuple)) else output).numpy()
+        return [postprocess(frame, layout, classes, confidence) for frame, layout in zip(output, layouts)]
+
+class OnnxDetector:
+    """An ONNX Runtime session over the exported model; also runs the INT8-quantized export."""
+
+    def __init__(self, size=INPUT_SIZE, threads=None, path=None, backend='onnx'):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.size = size
+        self.session = onnxruntime.InferenceSession(path or modelPath(backend, size), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = COCO_NAMES
+
+    def predict(self, images, classes=None, confidence=MODEL_CONFIDENCE):
+        batch, layouts = preprocess(images, self.size)
+        output = self.session.run(None, {self.input_name: batch})[0]
+        return [postprocess(frame, layout, classes, confidence) for frame, layout in zip(output, layouts)]
+
+def createDetector(backend=DETECT_BACKEND, size=INPUT_SIZE, threads=None):
+    """Build the detector for a backend name: torch, torchscript, onnx or int8."""
+    if backend == 'torch':
+        return TorchDetector(size, threads)
+    if backend == 'torchscript':
+        return TorchScriptDetector(size, threads)
+    if backend in ('onnx', 'int8'):
+        return OnnxDetector(size, threads, backend=backend)
+    raise ValueError(f"Unknown detector backend {backend}")
+
+def exportModel(backend, size=INPUT_SIZE):
+    """Export the hub model for a backend into MODELS_PATH. Returns the file written."""
+    import torch
+    os.makedirs(MODELS_PATH, exist_ok=True)
+    path = modelPath(backend, size)
+    if backend == 'int8':
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        source = modelPath('onnx', size)
+        if not os.path.exists(source):
+            exportModel('onnx', size)
+        quantize_dynamic(source, path, weight_type=QuantType.QUInt8)
+        return path
+
+    # Unwrap AutoShape -> DetectMultiBackend -> DetectionModel and make it return one tensor
+    network = loadModel().model.model.float().eval()
+    for module in network.modules():
+        if type(module).__name__ == 'Detect':
+            module.inplace = False
+            module.export = True
+    dummy = torch.zeros(1, 3, size, size)
+    if backend == 'torchscript':
+        torch.jit.trace(network, dummy, strict=False).save(path)
+    elif backend == 'onnx':
+        torch.onnx.export(network, dummy, path, opset_version=12, input_names=['images'], output_names=['output'],
+                          dynamic_axes={'images': {0: 'batch'}, 'output': {0: 'batch'}})
+    else:
+        raise ValueError(f"Cannot export backend {backend}")
+    return path
+
+COCO_NAMES = {0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus', 6: 'train', 7: 'truck',
+              8: 'boat', 9: 'traffic light', 10: 'fire hydrant', 11: 'stop sign', 12: 'parking meter', 13: 'bench',
+              14: 'bird', 15: 'cat', 16: 'dog', 17: 'horse', 18: 'sheep', 19: 'cow', 20: 'elephant', 21: 'bear',
+              22: 'zebra', 23: 'giraffe', 24: 'backpack', 25: 'umbrella', 26: 'handbag', 27: 'tie', 28: 'suitcase',
+              29: 'frisbee', 30: 'skis', 31: 'snowboard', 32: 'sports ball', 33: 'kite', 34: 'baseball bat',
+              35: 'baseball glove', 36: 'skateboard', 37: 'surfboard', 38: 'tennis racket', 39: 'bottle',
+              40: 'wine glass', 41: 'cup', 42: 'fork', 43: 'knife', 44: 'spoon', 45: 'bowl', 46: 'banana', 47: 'apple',
+              48: 'sandwich', 49: 'orange', 50: 'broccoli', 51: 'carrot', 52: 'hot dog', 53: 'pizza', 54: 'donut',
+              55: 'cake', 56: 'chair', 57: 'couch', 58: 'potted plant', 59: 'bed', 60: 'dining table', 61: 'toilet',
+              62: 'tv', 63: 'laptop', 64: 'mouse', 65: 'remote', 66: 'keyboard', 67: 'cell phone', 68: 'microwave',
+              69: 'oven', 70: 'toaster', 71: 'sink', 72: 'refrigerator', 73: 'book', 74: 'clock', 75: 'vase',
+              76: 'scissors', 77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'}
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == 'export':
+        size = int(sys.argv[3]) if len(sys.argv) > 3 else INPUT_SIZE
+        print(f"Wrote {exportModel(sys.argv[2], size)}")
+    else:
+        print("Usage: python Backends.py export torchscript|onnx|int8 [size]")
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime, timezone
+from Metrics import metrics
+
+# Consecutive failed sweeps before a camera is left out
+FAILURE_THRESHOLD = 3
+# How long a camera is left out the first time; doubled every time it trips again
+OPEN_SECONDS = 15 * 60
+MAX_OPEN_SECONDS = 4 * 60 * 60
+
+class CircuitBreaker:
+    """Tracks failing cameras so sweeps stop waiting on the ones that are down.
+
+    After FAILURE_THRESHOLD consecutive failures a camera's circuit opens and sweeps
+    skip it. Once the cool-down passes the camera gets one trial: a success closes the
+    circuit, another failure opens it again for twice as long.
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS, max_open_seconds=MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def allow(self, camera_id, now=None):
+        """Whether a sweep should try this camera."""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(camera_id)
+            return entry is None or entry['openUntil'] is None or now >= entry['openUntil']
+
+    def success(self, camera_id):
+        with self.lock:
+            self.entries.pop(camera_id, None)
+
+    def failure(self, camera_id, stage, error, now=None):
+        """Record a failed download or detection; returns True if the circuit is now open."""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.setdefault(camera_id, {'failures': 0, 'trips': 0, 'openUntil': None})
+            entry['failures'] += 1
+            entry['stage'] = stage
+            entry['lastError'] = str(error)
+            entry['lastFailure'] = now
+            if entry['failures'] < self.threshold:
+                return False
+            entry['trips'] += 1
+            entry['openUntil'] = now + min(self.open_seconds * 2 ** (entry['trips'] - 1), self.max_open_seconds)
+            return True
+
+    def openCount(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            return sum(1 for entry in self.entries.values() if entry['openUntil'] and now < entry['openUntil'])
+
+    def stats(self, now=None):
+        """Every camera with recent failures, with its last error and whether it is being skipped."""
+        now = now or time.time()
+        def stamp(seconds):
+            return datetime.fromtimestamp(seconds, timezone.utc).isoformat() if seconds else None
+        with self.lock:
+            cameras = {
+                camera_id: {
+                    'failures': entry['failures'],
+                    'stage': entry['stage'],
+                    'lastError': entry['lastError'],
+                    'lastFailure': stamp(entry['lastFailure']),
+                    'open': bool(entry['openUntil'] and now < entry['openUntil']),
+                    'retryAfter': stamp(entry['openUntil'])
+                }
+                for camera_id, entry in self.entries.items()
+            }
+        return {
+            'failing': len(cameras),
+            'open': sum(camera['open'] for camera in cameras.values()),
+            'cameras': cameras
+        }
+
+camera_breaker = CircuitBreaker()
+metrics.callback('foodcameras_camera_circuits_open', 'Cameras currently skipped after repeated failures', 'gauge',
+                 lambda: camera_breaker.openCount())
@@ -1,26 +1,41 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
 from peewee import *
 
-API_LOCATIONS_URL = "https://mkt-api.gcu.edu/linecam/api/v1/locations"
-API_IMAGES_URL = "https://mkt-api.gcu.edu/linecam/api/v1/images?includeImages=true&includeInactive=false&location="
+# Point LINECAM_API_URL at a local stand-in to run sweeps without the GCU API
+API_BASE_URL = os.environ.get('LINECAM_API_URL', "https://mkt-api.gcu.edu/linecam/api/v1")
+API_LOCATIONS_URL = f"{API_BASE_URL}/locations"
+API_IMAGES_URL = f"{API_BASE_URL}/images?includeImages=true&includeInactive=false&location="
+API_TIMEOUT = 10
 
 # Enable WAL mode for improved concurrent writes
 db = SqliteDatabase('database.db', pragmas={'journal_mode': 'wal'})
 
-def fetch_camera_images(location_name):
+def createSession(pool_size=10):
+    """Create a requests session that keeps up to pool_size connections alive per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+session = createSession()
+
+def fetch_camera_images(location_name, timeout=API_TIMEOUT):
     """Fetch images for a location from the API."""
-    response = requests.get(f"{API_IMAGES_URL}{location_name}")
+    response = session.get(f"{API_IMAGES_URL}{location_name}", timeout=timeout)
     response.raise_for_status()
     return response.json()
 
-def fetch_locations_from_api():
+def fetch_locations_from_api(timeout=API_TIMEOUT):
     """Fetch locations from the API."""
-    response = requests.get(API_LOCATIONS_URL)
+    response = session.get(API_LOCATIONS_URL, timeout=timeout)
     response.raise_for_status()
     return response.json()
 
 class Location(Model):
-    name = CharField()
+    name = CharField(index=True)
     building = CharField()
     longitude = CharField()
     latitude = CharField()
@@ -30,9 +45,9 @@ class Location(Model):
         database = db
     
 class Camera(Model):
-    cameraId = IntegerField(default=0)
+    cameraId = IntegerField(default=0, index=True)
     name = CharField()
-    locationName = CharField()
+    locationName = CharField(index=True)
     peopleCount = IntegerField(default=0)
     timestamp = DateTimeField(formats='ISO-8601')
     image = CharField()
@@ -40,6 +55,24 @@ class Camera(Model):
     class Meta:
         database = db
 
+class LocationSnapshot(Model):
+    """One row per location name with its cameras' latest counts combined, rewritten by every sweep."""
+    name = CharField(unique=True)
+    # First Location row with this name, so the list keeps its old ids and order
+    locationId = IntegerField()
+    building = CharField()
+    longitude = CharField()
+    latitude = CharField()
+    trafficLevel = CharField()
+    # Sum and max of the latest peopleCount across the location's cameras
+    peopleCount = IntegerField(default=0)
+    maxCount = IntegerField(default=0)
+    cameras = IntegerField(default=0)
+    timestamp = DateTimeField(formats='ISO-8601', null=True)
+
+    class Meta:
+        database = db
+
 #db.create_tables([Location, Camera])
     
 def populateLocationsAndCameras():
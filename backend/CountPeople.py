@@ -1,107 +1,273 @@
 import sqlite3
-import requests
 import json
 import cv2
 import os
-import numpy as np
 from datetime import datetime, timedelta
 from dateutil import parser
-from io import BytesIO
-from Detect import loadModel, detect
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from Detect import annotate, BATCH_SIZE, DETECT_THRESHOLD
+from DetectService import DetectionService
+from FrameCache import frame_cache
+from SweepWriter import SweepWriter, calculate_busy_level
+from Fetch import fetch_cameras, fetch_frames, NOT_MODIFIED, FETCH_WORKERS, FETCH_TIMEOUT
+from ImageStore import image_store
+from Metrics import metrics, stage_seconds
+from CircuitBreaker import camera_breaker
+from Archive import FrameArchive, ARCHIVE_FRAMES
 from Core import *
 from Analytics import *
-import sys, os
+import time
 import random
 
 db = SqliteDatabase('database.db', pragmas={'journal_mode': 'wal'})
 
-# Load the YOLO model
-model = loadModel()
-
-API_LOCATIONS_URL = "https://mkt-api.gcu.edu/linecam/api/v1/locations"
-API_IMAGES_URL = "https://mkt-api.gcu.edu/linecam/api/v1/images?includeImages=true&includeInactive=false&location="
+# YOLO runs in worker processes; each loads the model on its first batch
+detector = DetectionService()
+# Raw JPEGs kept for replay when ARCHIVE_FRAMES is on
+archive = FrameArchive() if ARCHIVE_FRAMES else None
 
 DB_FILE = './database.db'
 INPUT_IMAGES_PATH = './input_images'
-OUTPUT_IMAGES_PATH = './static'
-os.makedirs(INPUT_IMAGES_PATH, exist_ok=True)
-os.makedirs(OUTPUT_IMAGES_PATH, exist_ok=True)
+# Keep a copy of every raw camera frame in INPUT_IMAGES_PATH (debugging only)
+SAVE_INPUT_IMAGES = False
+# Draw the person boxes on the images written to the image store
+ANNOTATE_IMAGES = True
+# Seconds a sweep waits for its outstanding detector batches, all together, before giving up on them
+DETECT_TIMEOUT = 300
+if SAVE_INPUT_IMAGES:
+    os.makedirs(INPUT_IMAGES_PATH, exist_ok=True)
 
-def pushCamera(data):
-    with db.connection_context():
-        camera = Camera.get(Camera.cameraId == data['id'])
-        print(f"data peopleCount: {data['peopleCount']}")
-        camera.peopleCount = data['peopleCount']
-        camera.timestamp = data['timestamp']
-        camera.image = data['imagePath']
-        camera.save()
-        
-def pushTraffic(data):
-    with db.connection_context():
-        camera = Camera.get(Camera.cameraId == data['id'])
-        location = Location.get(Location.name == camera.locationName)
-        location.trafficLevel = calculate_busy_level(data['peopleCount'])
-        location.save()
-
-def calculate_busy_level(num_people):
-    if num_people == 0:
-        return "Empty"
-    elif num_people < 5:
-        return "Low"
-    elif num_people < 15:
-        return "Medium"
-    else:
-        return "High"
-    
-def get_locations():
+cameras_processed = metrics.counter('foodcameras_cameras_processed_total', 'Camera frames counted by sweeps', ['source'])
+camera_failures = metrics.counter('foodcameras_camera_failures_total', 'Camera frames a sweep could not count', ['stage'])
+cameras_skipped = metrics.counter('foodcameras_cameras_skipped_total', 'Cameras left out of a sweep by an open circuit')
+
+def get_locations(names=None):
     with db.connection_context():
         locations = (Location
                      .select(Location.building, fn.COUNT(Location.id).alias('count'))
                      .group_by(Location.building))
+        if names is not None:
+            locations = locations.where(Location.name.in_(list(names)))
         return list(locations)
 
-def process_locations():
-    print('processing locations')
-    locations = get_locations()
-    
-    for location in locations:
-        cameras = fetch_camera_images(location.building)
+def camera_locations():
+    """Map of API camera id to the location name it belongs to."""
+    with db.connection_context():
+        return dict(Camera.select(Camera.cameraId, Camera.locationName).tuples())
+
+def stored_counts(camera_ids):
+    """(cameraId, timestamp, peopleCount) of each camera as the last sweep stored it."""
+    with db.connection_context():
+        return list(Camera
+                    .select(Camera.cameraId, Camera.timestamp, Camera.peopleCount)
+                    .where(Camera.cameraId.in_(list(camera_ids)))
+                    .tuples())
+
+def image_prefix(camera):
+    return f"{camera['id']}_{camera['description'].replace(' ', '_')}"
+
+def save_annotated(camera, image_file, boxes, writer):
+    """Encode the frame into the image store, drawing the detections first if ANNOTATE_IMAGES is on.
+
+    The camera keeps its previous image if this fails.
+    """
+    try:
+        if ANNOTATE_IMAGES:
+            with stage_seconds.time(stage='annotate'):
+                annotate(image_file, boxes)
+        with stage_seconds.time(stage='encode'):
+            writer.image(camera['id'], image_store.save(image_prefix(camera), image_file))
+    except Exception as e:
+        print(f"Failed to save the image of {camera['description']}: {e}")
+
+def frame_data(camera, people_count=0):
+    return {
+        "id": camera['id'],
+        "timestamp": camera['updated_at'],
+        "peopleCount": people_count
+    }
+
+def store_result(camera, data, writer):
+    busy_level = calculate_busy_level(data['peopleCount'])
+    writer.add(data)
+    print(f"Processed {camera['description']}: {data['peopleCount']} people detected, {busy_level} busy level.")
+
+def store_unchanged(camera, people_count, writer, source):
+    """Store a camera whose frame has not changed with its last count; its image stays as it is."""
+    store_result(camera, frame_data(camera, people_count), writer)
+    camera_breaker.success(camera['id'])
+    cameras_processed.inc(source=source)
+
+def record_failure(camera, stage, error):
+    """Count a camera that could not be processed this sweep and feed its circuit breaker."""
+    print(f"Failed to {stage} {camera['description']}: {error}")
+    camera_failures.inc(stage=stage)
+    if camera_breaker.failure(camera['id'], stage, error):
+        print(f"Skipping {camera['description']} in the next sweeps after repeated failures")
+
+def detect_frames(frames):
+    """Send a batch of downloaded frames to the detector pool without waiting for it."""
+    try:
+        return frames, detector.submit([image_file for _, _, image_file, _ in frames], DETECT_THRESHOLD)
+    except Exception as e:
+        # Reported with the batch's results, like a failure inside the pool
+        future = Future()
+        future.set_exception(e)
+        return frames, future
+
+def process_frames(frames, detections, encoder, writer):
+    """Store the detections for a batch of frames.
+
+    Annotated images are encoded on the encoder pool so the next batch can start inference.
+    """
+    for (camera, data, image_file, signature), (people_count, boxes) in zip(frames, detections):
+        frame_cache.store(camera, signature, people_count)
+        encoder.submit(save_annotated, camera, image_file, boxes, writer)
+        data['peopleCount'] = people_count
+        store_result(camera, data, writer)
+        camera_breaker.success(camera['id'])
+        cameras_processed.inc(source='detector')
+
+def detect_alone(frames, encoder, writer, deadline=None):
+    """Retry the frames of a failed batch one by one, so a bad frame only costs its own camera.
+
+    All of the retries share one deadline, DETECT_TIMEOUT from now unless one is given.
+    """
+    deadline = deadline or time.monotonic() + DETECT_TIMEOUT
+    for index, frame in enumerate(frames):
         try:
-            print(len(cameras))
-            for camera in cameras:
-                print(camera['description'])
-                data = {
-                    "id": camera['id'],
-                    "timestamp": camera['updated_at'],
-                    "peopleCount": 0,
-                    "imagePath": ""
-                }
-                response = requests.get(camera['url'])
-                response.raise_for_status()
-                image = BytesIO(response.content)
-                image_array = np.frombuffer(image.getvalue(), dtype=np.uint8)
-                image_file = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-                if image_file is None:
-                    raise ValueError("Failed to decode image")
-                image_name = f"{data['id']}_{camera['description'].replace(' ', '_')}.jpg"
-                input_image_path = os.path.join(INPUT_IMAGES_PATH, image_name)
-                cv2.imwrite(input_image_path, image_file)
-                people_count, annotated_image = detect(input_image_path, model, OUTPUT_IMAGES_PATH, 0.15)
-                output_image_path = os.path.join(OUTPUT_IMAGES_PATH, image_name)
-                cv2.imwrite(output_image_path, annotated_image)
-                busy_level = calculate_busy_level(people_count)
-                data['peopleCount'] = people_count
-                data['imagePath'] = image_name
-                pushCamera(data)
-                pushTraffic(data)
-                pushFrame(data)
-                pushAnalytics(data)
-                print(f"Processed {camera['description']}: {people_count} people detected, {busy_level} busy level.")
+            detections = detector.detect([frame[2]], DETECT_THRESHOLD, max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            detector.restart()
+            for camera, _, _, _ in frames[index:]:
+                record_failure(camera, 'detect', 'timed out')
+            return
+        except BrokenProcessPool as e:
+            if not detector.started:
+                # The workers cannot load the model, so no frame will get through this sweep
+                for camera, _, _, _ in frames[index:]:
+                    record_failure(camera, 'detect', e)
+                return
+            record_failure(frame[0], 'detect', e)
+            continue
         except Exception as e:
-            print(e)
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(exc_type, fname, exc_tb.tb_lineno)
+            record_failure(frame[0], 'detect', e)
+            continue
+        process_frames([frame], detections, encoder, writer)
+
+def finish_batches(pending, encoder, writer, deadline=None):
+    """Store every finished batch and return the rest.
+
+    With a deadline, wait until then for all of them together; batches still running
+    at the deadline fail and the detector pool is replaced, since its workers are stuck.
+    """
+    if deadline is not None:
+        wait([future for _, future in pending], timeout=max(deadline - time.monotonic(), 0))
+    remaining = []
+    timed_out = False
+    for frames, future in pending:
+        if not future.done():
+            if deadline is None:
+                remaining.append((frames, future))
+                continue
+            timed_out = True
+            for camera, _, _, _ in frames:
+                record_failure(camera, 'detect', 'timed out')
+            continue
+        try:
+            detections = future.result()
+        except BrokenProcessPool as e:
+            if not detector.started:
+                # Retrying frame by frame would only start more pools that cannot load the model
+                for camera, _, _, _ in frames:
+                    record_failure(camera, 'detect', e)
+                continue
+            print(f"Detector pool broke under {len(frames)} frames, retrying them one at a time: {e}")
+            detect_alone(frames, encoder, writer, deadline)
+            continue
+        except Exception as e:
+            print(f"Detection failed for {len(frames)} frames, retrying them one at a time: {e}")
+            detect_alone(frames, encoder, writer, deadline)
+            continue
+        process_frames(frames, detections, encoder, writer)
+    if timed_out:
+        detector.restart()
+    return remaining
+
+def process_locations(names=None, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT):
+    """Count people at every location, or only at the location names given."""
+    print('processing locations')
+    detector.recover()
+    start = time.perf_counter()
+    locations = get_locations(names)
+    cameras = fetch_cameras([location.building for location in locations], workers, timeout)
+    if names is not None:
+        # A building can hold several locations; only sweep the cameras that were asked for
+        owners = camera_locations()
+        cameras = [camera for camera in cameras if owners.get(camera['id']) in names]
+    # Cameras that keep failing sit out until their circuit breaker lets them retry
+    allowed = [camera for camera in cameras if camera_breaker.allow(camera['id'])]
+    if len(allowed) < len(cameras):
+        print(f"Skipping {len(cameras) - len(allowed)} failing cameras")
+        cameras_skipped.inc(len(cameras) - len(allowed))
+    cameras = allowed
+    print(len(cameras))
+    
+    writer = SweepWriter()
+    # Cameras whose updated_at has not moved since the last sweep are not downloaded again,
+    # including the sweep before a restart
+    unseen = {camera['id'] for camera in cameras} - frame_cache.entries.keys()
+    if unseen:
+        frame_cache.seed(stored_counts(unseen))
+    changed = []
+    for camera in cameras:
+        people_count = frame_cache.current(camera)
+        if people_count is None:
+            changed.append(camera)
+        else:
+            store_unchanged(camera, people_count, writer, 'unchanged')
+    if len(changed) < len(cameras):
+        print(f"Skipping {len(cameras) - len(changed)} unchanged frames")
+
+    # Downloads run on a thread pool while this thread feeds finished frames to the detector pool
+    batch = []
+    pending = []
+    frames = fetch_frames(changed, workers, timeout, archive=archive, validators=frame_cache.validators)
+    with ThreadPoolExecutor(max_workers=1) as encoder, closing(frames):
+        for camera, image_file, error in frames:
+            if error is not None:
+                record_failure(camera, 'fetch', error)
+                continue
+            if image_file is NOT_MODIFIED:
+                store_unchanged(camera, frame_cache.current(camera, not_modified=True), writer, 'not_modified')
+                continue
+            data = frame_data(camera)
+            if SAVE_INPUT_IMAGES:
+                cv2.imwrite(os.path.join(INPUT_IMAGES_PATH, f"{image_prefix(camera)}.jpg"), image_file)
+            # Frames that barely changed reuse the last count and annotated image without inference
+            people_count, signature = frame_cache.lookup(camera, image_file)
+            if people_count is not None:
+                store_unchanged(camera, people_count, writer, 'cache')
+                continue
+            batch.append((camera, data, image_file, signature))
+            if len(batch) == BATCH_SIZE:
+                pending.append(detect_frames(batch))
+                batch = []
+            pending = finish_batches(pending, encoder, writer)
+            while len(pending) > detector.workers * 2:
+                # Each batch holds its frames in shared memory until it finishes; waiting on the
+                # oldest keeps them bounded and lets the download backlog push back
+                pending = finish_batches(pending[:1], encoder, writer,
+                                         deadline=time.monotonic() + DETECT_TIMEOUT) + pending[1:]
+        if batch:
+            pending.append(detect_frames(batch))
+        finish_batches(pending, encoder, writer, deadline=time.monotonic() + DETECT_TIMEOUT)
+    print(f"Frame cache: {frame_cache.stats()}")
+    stats = writer.commit()
+    stage_seconds.observe(time.perf_counter() - start, stage='sweep')
+    return stats
 
 if __name__ == "__main__":
     process_locations()
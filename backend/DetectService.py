@@ -0,0 +1,138 @@
+import os
+import multiprocessing
+import numpy as np
+from time import perf_counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from Detect import detect_batch, BATCH_SIZE
+from Backends import createDetector, DETECT_BACKEND, INPUT_SIZE
+from Metrics import metrics, stage_seconds
+
+# Detector processes; each one loads its own copy of the model
+DETECT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+_detector = None
+
+batch_frames = metrics.histogram('foodcameras_detect_batch_frames', 'Frames per batch sent to the detector pool',
+                                 buckets=(1, 2, 4, 8, 16, 32, 64))
+
+def _startWorker(backend, size, threads):
+    """Load the model once per worker process and split the cores between workers."""
+    global _detector
+    _detector = createDetector(backend, size, threads)
+
+def _detectShared(name, layout, threshold, batch_size):
+    """Worker task: read a batch of frames out of shared memory and detect people in them.
+
+    Returns the detections and the seconds the worker spent on them.
+    """
+    start = perf_counter()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        images = [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                  for offset, shape, dtype in layout]
+    finally:
+        shm.close()
+    return detect_batch(images, _detector, threshold, batch_size), perf_counter() - start
+
+class DetectionService:
+    """Runs YOLOv5 in a pool of worker processes, away from the web server and its GIL.
+
+    Frames are handed to a worker through one shared-memory block per batch, so only
+    their layout and the resulting boxes cross the process boundary.
+    """
+
+    def __init__(self, workers=DETECT_WORKERS, batch_size=BATCH_SIZE, backend=DETECT_BACKEND, size=INPUT_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.backend = backend
+        self.size = size
+        self.pool = self.createPool()
+
+    def createPool(self):
+        # started: a worker of this pool finished a batch, so the model loads; broken: the pool died
+        self.started = False
+        self.broken = False
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # Worker processes start on the first submit, not here
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_startWorker, initargs=(self.backend, self.size, threads))
+
+    def submit(self, images, threshold):
+        """Queue a batch of frames; the future resolves to [(people_count, boxes)] in order."""
+        shm = shared_memory.SharedMemory(create=True, size=max(1, sum(image.nbytes for image in images)))
+        layout = []
+        offset = 0
+        for image in images:
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf, offset=offset)[:] = image
+            layout.append((offset, image.shape, image.dtype.str))
+            offset += image.nbytes
+        try:
+            if self.broken:
+                raise BrokenProcessPool("Detector pool is broken")
+            future = self.pool.submit(_detectShared, shm.name, layout, threshold, self.batch_size)
+        except BrokenProcessPool:
+            if not self.started:
+                # The workers never finished a batch, so they cannot load the model and a new pool
+                # would break the same way; recover() gives it another try at the next sweep
+                shm.close()
+                shm.unlink()
+                raise
+            # A worker died (e.g. out of memory); start a fresh pool and try once more
+            print("Detector pool broke, restarting workers")
+            self.pool = self.createPool()
+            try:
+                future = self.pool.submit(_detectShared, shm.name, layout, threshold, self.batch_size)
+            except Exception:
+                shm.close()
+                shm.unlink()
+                raise
+
+        batch_frames.observe(len(images))
+        result = Future()
+        pool = self.pool
+
+        def release(future):
+            shm.close()
+            shm.unlink()
+            try:
+                detections, seconds = future.result()
+            except Exception as e:
+                # Batches of a pool that was already replaced say nothing about the current one
+                if isinstance(e, BrokenProcessPool) and pool is self.pool:
+                    self.broken = True
+                result.set_exception(e)
+                return
+            if pool is self.pool:
+                self.started = True
+            stage_seconds.observe(seconds, stage='inference')
+            result.set_result(detections)
+        future.add_done_callback(release)
+        return result
+
+    def recover(self):
+        """Replace a broken pool, e.g. one whose workers could not load the model last sweep."""
+        if self.broken:
+            print("Detector pool is broken, starting new workers")
+            broken = self.pool
+            self.pool = self.createPool()
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def restart(self):
+        """Replace a pool whose workers stopped answering; their pending batches fail."""
+        print("Detector pool stopped responding, restarting workers")
+        stuck = self.pool
+        self.pool = self.createPool()
+        # ProcessPoolExecutor cannot kill busy workers itself before Python 3.14
+        for process in list((getattr(stuck, '_processes', None) or {}).values()):
+            process.terminate()
+        stuck.shutdown(wait=False, cancel_futures=True)
+
+    def detect(self, images, threshold, timeout=None):
+        """Detect people in frames and wait up to timeout seconds for the result."""
+        return self.submit(images, threshold).result(timeout)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,129 @@
+import threading
+import queue
+import time
+import random
+import requests
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from Core import createSession, fetch_camera_images
+from Metrics import metrics, stage_seconds
+
+# Number of camera images downloaded at the same time
+FETCH_WORKERS = 8
+# Seconds to wait for a single camera image
+FETCH_TIMEOUT = 10
+# Extra attempts for a failed download, waiting RETRY_BACKOFF seconds and doubling each time
+FETCH_RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+_DONE = object()
+# Returned in place of an image when the server answers a conditional download with 304
+NOT_MODIFIED = object()
+
+fetch_retries = metrics.counter('foodcameras_fetch_retries_total', 'Camera listing and image downloads retried', ['kind'])
+
+def retryable(error):
+    """Client errors (404 and the like) will not fix themselves; everything else is worth another try."""
+    response = getattr(error, 'response', None)
+    return not (isinstance(error, requests.HTTPError) and response is not None and response.status_code < 500)
+
+def withRetries(call, kind, retries=FETCH_RETRIES, backoff=RETRY_BACKOFF):
+    """Call until it succeeds, retrying transient errors with jittered exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+        fetch_retries.inc(kind=kind)
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def fetch_cameras(buildings, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES):
+    """Fetch the camera listings for every building concurrently.
+
+    Returns a flat list of camera dicts; buildings that fail are printed and skipped.
+    """
+    def listing(building):
+        try:
+            with stage_seconds.time(stage='listing'):
+                return withRetries(lambda: fetch_camera_images(building, timeout=timeout), 'listing', retries)
+        except Exception as e:
+            print(f"Failed to fetch cameras for {building}: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [camera for cameras in pool.map(listing, buildings) for camera in cameras]
+
+def download_frame(session, camera, timeout=FETCH_TIMEOUT, archive=None, validators=None):
+    """One attempt at downloading and decoding a camera image, archiving the JPEG if an archive is given.
+
+    validators(camera) gives If-None-Match/If-Modified-Since headers; a 304 returns NOT_MODIFIED.
+    The response's ETag and Last-Modified are kept on the camera for the next sweep.
+    """
+    headers = validators(camera) if validators else None
+    with stage_seconds.time(stage='download'):
+        response = session.get(camera['url'], timeout=timeout, headers=headers)
+        response.raise_for_status()
+    if response.status_code == 304:
+        return NOT_MODIFIED
+    camera['etag'] = response.headers.get('ETag')
+    camera['lastModified'] = response.headers.get('Last-Modified')
+    with stage_seconds.time(stage='decode'):
+        image_array = np.frombuffer(response.content, dtype=np.uint8)
+        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    if image is None:
+        # Usually a truncated download, so it is retried like a network error
+        raise ValueError("Failed to decode image")
+    if archive is not None:
+        archive.append(camera['id'], camera['updated_at'], response.content)
+    return image
+
+def fetch_frame(session, camera, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES, archive=None, validators=None):
+    """Download and decode one camera image, retrying transient failures. Returns (camera, image, error)."""
+    try:
+        return camera, withRetries(lambda: download_frame(session, camera, timeout, archive, validators), 'image',
+                                   retries), None
+    except Exception as e:
+        return camera, None, e
+
+def fetch_frames(cameras, workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, backlog=None, session=None,
+                 retries=FETCH_RETRIES, archive=None, validators=None):
+    """Download and decode camera images on a thread pool, yielding (camera, image, error) as they finish.
+
+    At most backlog decoded frames are buffered, so downloads pause while the consumer
+    (the detector) catches up instead of holding every frame in memory. Each camera is
+    its own task, so one that times out or keeps failing only holds up its own thread.
+    Closing the generator early stops the remaining downloads and releases their threads.
+    """
+    session = session or createSession(workers)
+    frames = queue.Queue(maxsize=backlog or workers * 2)
+    stopped = threading.Event()
+
+    def put(item):
+        # A consumer that stopped reading would leave a blocking put() waiting forever
+        while not stopped.is_set():
+            try:
+                frames.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def produce(camera):
+        if not stopped.is_set():
+            put(fetch_frame(session, camera, timeout, retries, archive, validators))
+
+    def feed():
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(produce, cameras))
+        put(_DONE)
+
+    threading.Thread(target=feed, daemon=True).start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is _DONE:
+                return
+            yield frame
+    finally:
+        stopped.set()
@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from Core import Camera, db
+from Analytics import Analytics, ARIZONA_TZ, utcTimestamp
+from Metrics import metrics
+
+# Days of Analytics history the model is fitted on
+HISTORY_DAYS = 90
+# A sample this many days old weighs half as much as a new one
+HALF_LIFE_DAYS = 28
+# Pseudo-samples pulling a sparse cell toward the coarser average above it
+SHRINKAGE = 3.0
+# How far ahead forecasts go
+FORECAST_HOURS = 4
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+fit_seconds = metrics.histogram('foodcameras_forecast_fit_seconds', 'Seconds spent fitting the occupancy forecast')
+
+def shrink(weight, total, prior, strength=SHRINKAGE):
+    """Weighted mean of a cell, pulled toward prior when the cell has few samples."""
+    return (total + strength * prior) / (weight + strength)
+
+def slotStart(moment):
+    minutes = (moment.hour * 60 + moment.minute) // SLOT_MINUTES * SLOT_MINUTES
+    return moment.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+class Forecaster:
+    """Seasonal occupancy model: an expected count per camera x summer x weekday x half hour.
+
+    fit() reads the Analytics history in one query and fits every camera at once with
+    bincounts over a flat cell index, weighting recent samples more. Sparse cells borrow
+    from the same half hour on other weekdays, then in either season, then from the
+    camera's overall mean. refresh() runs after each sweep and precomputes every
+    location's forecast, so requests only ever read results.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.locations = {}
+        self.forecasts = {}
+        self.lock = threading.Lock()
+
+    def fit(self, now=None):
+        """Fit the model on the last HISTORY_DAYS of samples. Returns None when there is no history."""
+        import numpy as np
+        import pandas as pd
+
+        now = now or datetime.now(ARIZONA_TZ)
+        with db.connection_context():
+            samples = pd.DataFrame(list(Analytics
+                                        .select(Analytics.cameraId, Analytics.timestamp, Analytics.peopleCount)
+                                        .where(Analytics.timestamp >= utcTimestamp(now - timedelta(days=HISTORY_DAYS)))
+                                        .tuples()),
+                                   columns=['cameraId', 'timestamp', 'peopleCount'])
+        if samples.empty:
+            return None
+
+        utc = pd.to_datetime(samples['timestamp'], utc=True, format='ISO8601')
+        local = utc.dt.tz_convert(ARIZONA_TZ.zone)
+        cameras, camera_ids = pd.factorize(samples['cameraId'])
+        summer = local.dt.month.between(5, 8).to_numpy(dtype=np.int64)
+        weekday = local.dt.dayofweek.to_numpy()
+        slot = ((local.dt.hour * 60 + local.dt.minute) // SLOT_MINUTES).to_numpy()
+        count = samples['peopleCount'].to_numpy(dtype=np.float64)
+        age_days = (pd.Timestamp(now).tz_convert('UTC') - utc).dt.total_seconds().to_numpy() / 86400
+        weight = 0.5 ** (np.clip(age_days, 0, None) / HALF_LIFE_DAYS)
+
+        # Weighted sums of 1, x and x^2 for every (camera, summer, weekday, slot) cell
+        shape = (len(camera_ids), 2, 7, SLOTS_PER_DAY)
+        cell = np.ravel_multi_index((cameras, summer, weekday, slot), shape)
+        sums = [np.bincount(cell, weights=weight * count ** power, minlength=np.prod(shape)).reshape(shape)
+                for power in (0, 1, 2)]
+
+        # Camera -> half hour in any season -> half hour this season -> this weekday
+        camera_level = [total.sum(axis=(1, 2, 3), keepdims=True) for total in sums]
+        moments = [total / np.maximum(camera_level[0], 1e-9) for total in camera_level[1:]]
+        for axes in ((1, 2), (2,), ()):
+            level = [total.sum(axis=axes, keepdims=True) if axes else total for total in sums]
+            moments = [shrink(level[0], level[power], moments[power - 1]) for power in (1, 2)]
+        mean, square = moments
+        return {
+            'cameras': {int(camera_id): index for index, camera_id in enumerate(camera_ids)},
+            'mean': mean,
+            'stddev': np.sqrt(np.clip(square - mean * mean, 0, None)),
+            'fitted': now,
+            'samples': len(samples)
+        }
+
+    def predict(self, model, camera_ids, now, hours=FORECAST_HOURS):
+        """Summed forecast for a set of cameras over the half hours after now."""
+        import numpy as np
+
+        known = [model['cameras'][camera_id] for camera_id in camera_ids if camera_id in model['cameras']]
+        start = slotStart(now) + timedelta(minutes=SLOT_MINUTES)
+        times = [start + timedelta(minutes=SLOT_MINUTES * step) for step in range(hours * 60 // SLOT_MINUTES)]
+        if not known:
+            return []
+        index = (np.array(known)[:, None],
+                 np.array([5 <= moment.month <= 8 for moment in times], dtype=np.int64)[None, :],
+                 np.array([moment.weekday() for moment in times])[None, :],
+                 np.array([(moment.hour * 60 + moment.minute) // SLOT_MINUTES for moment in times])[None, :])
+        # Cameras add up, as in the location snapshot; their spreads add as variances
+        predicted = model['mean'][index].sum(axis=0)
+        stddev = np.sqrt((model['stddev'][index] ** 2).sum(axis=0))
+        return [{
+            'time': moment.replace(tzinfo=None).isoformat(),
+            'predicted': round(float(value), 2),
+            'low': round(float(max(value - spread, 0)), 2),
+            'high': round(float(value + spread), 2)
+        } for moment, value, spread in zip(times, predicted, stddev)]
+
+    def build(self, model, name, now):
+        return {
+            'location': name,
+            'generated': now.replace(tzinfo=None).isoformat(),
+            'fitted': model['fitted'].replace(tzinfo=None).isoformat(),
+            'slot': slotStart(now),
+            'points': self.predict(model, self.locations[name], now)
+        }
+
+    def refresh(self, now=None):
+        """Refit the model and precompute every location's forecast."""
+        start = time.perf_counter()
+        now = now or datetime.now(ARIZONA_TZ)
+        model = self.fit(now)
+        with db.connection_context():
+            locations = {}
+            for camera_id, name in Camera.select(Camera.cameraId, Camera.locationName).tuples():
+                locations.setdefault(name, []).append(camera_id)
+        with self.lock:
+            self.model = model
+            self.locations = locations
+            self.forecasts = {name: self.build(model, name, now) for name in locations} if model else {}
+        fit_seconds.observe(time.perf_counter() - start)
+        print(f"Forecast fitted on {model['samples'] if model else 0} samples in {time.perf_counter() - start:.2f}s")
+
+    def ready(self):
+        return self.model is not None
+
+    def forecast(self, name, now=None):
+        """The precomputed forecast for a location, or None if it is unknown.
+
+        Forecasts computed in an earlier half hour are rebuilt from the fitted model,
+        which is a lookup, not a refit.
+        """
+        now = now or datetime.now(ARIZONA_TZ)
+        with self.lock:
+            if self.model is None or name not in self.locations:
+                return None
+            forecast = self.forecasts.get(name)
+            if forecast is None or forecast['slot'] != slotStart(now):
+                forecast = self.forecasts[name] = self.build(self.model, name, now)
+        return {key: value for key, value in forecast.items() if key != 'slot'}
+
+forecaster = Forecaster()
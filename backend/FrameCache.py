@@ -0,0 +1,112 @@
+import threading
+from Metrics import metrics
+
+# Frames are compared as SIGNATURE_SIZE x SIGNATURE_SIZE grayscale thumbnails
+SIGNATURE_SIZE = 32
+# Mean absolute pixel difference (0-255) below which two frames count as unchanged
+CHANGE_THRESHOLD = 2.0
+
+class FrameCache:
+    """Remembers the last frame seen for each camera so unchanged frames can skip inference.
+
+    A camera whose updated_at has not moved, or whose image server answers a conditional
+    request with 304, is not downloaded at all. A downloaded frame is unchanged when its
+    downscaled grayscale thumbnail is within CHANGE_THRESHOLD of the previous one.
+    After a restart the cache is seeded from the Camera table, which has no thumbnails.
+    """
+
+    def __init__(self, threshold=CHANGE_THRESHOLD, size=SIGNATURE_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def signature(self, image):
+        import cv2
+        import numpy as np
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def current(self, camera, not_modified=False):
+        """The last count for a camera known to be unchanged without looking at its image, else None.
+
+        Pass not_modified when the image server answered 304 to the conditional download.
+        """
+        entry = self.entries.get(camera['id'])
+        if entry is None or not (not_modified or entry['updated_at'] == camera['updated_at']):
+            return None
+        with self.lock:
+            self.hits += 1
+        entry['updated_at'] = camera['updated_at']
+        return entry['peopleCount']
+
+    def seed(self, stored):
+        """Add cameras the cache has not seen from their stored (cameraId, timestamp, peopleCount)."""
+        for camera_id, timestamp, people_count in stored:
+            self.entries.setdefault(camera_id, {
+                'updated_at': timestamp,
+                'signature': None,
+                'peopleCount': people_count,
+                'etag': None,
+                'lastModified': None
+            })
+
+    def validators(self, camera):
+        """If-None-Match/If-Modified-Since headers for downloading a camera's image again."""
+        entry = self.entries.get(camera['id'])
+        if entry is None:
+            # Nothing to fall back on if the server said 304
+            return {}
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['lastModified']:
+            headers['If-Modified-Since'] = entry['lastModified']
+        return headers
+
+    def lookup(self, camera, image):
+        """Return (peopleCount, signature); peopleCount is None when the frame needs detection."""
+        signature = self.signature(image)
+        entry = self.entries.get(camera['id'])
+        unchanged = entry is not None and (
+            entry['updated_at'] == camera['updated_at'] or
+            entry['signature'] is not None and abs(entry['signature'] - signature).mean() < self.threshold
+        )
+        with self.lock:
+            if unchanged:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if unchanged:
+            entry.update(updated_at=camera['updated_at'], etag=camera.get('etag'), lastModified=camera.get('lastModified'))
+            return entry['peopleCount'], signature
+        return None, signature
+
+    def store(self, camera, signature, people_count):
+        self.entries[camera['id']] = {
+            'updated_at': camera['updated_at'],
+            'signature': signature,
+            'peopleCount': people_count,
+            # Validators of the downloaded image, set on the camera by Fetch.download_frame
+            'etag': camera.get('etag'),
+            'lastModified': camera.get('lastModified')
+        }
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': self.hits / total if total else 0.0,
+                'cameras': len(self.entries)
+            }
+
+# cv2 and numpy are imported on first use so the API can import this for stats
+frame_cache = FrameCache()
+metrics.callback('foodcameras_frame_cache_hits_total', 'Frames that reused the last count instead of running inference',
+                 'counter', lambda: frame_cache.hits)
+metrics.callback('foodcameras_frame_cache_misses_total', 'Frames sent to the detector', 'counter',
+                 lambda: frame_cache.misses)
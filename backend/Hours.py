@@ -0,0 +1,100 @@
+import os
+import json
+import threading
+from datetime import datetime
+import pytz
+
+HOURS_FILE = 'hours.json'
+ARIZONA_TZ = pytz.timezone('America/Phoenix')
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+WEEK_MINUTES = 7 * 24 * 60
+
+def normalize(name):
+    """Key used to match location names regardless of case and spacing."""
+    return ' '.join(name.lower().split())
+
+def toMinutes(value):
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+def weekMinute(now):
+    """Minutes since Monday 00:00 for an Arizona local datetime."""
+    return now.weekday() * 24 * 60 + now.hour * 60 + now.minute
+
+def openIntervals(hours):
+    """Turn a location's {day: {open, close}} hours into sorted (start, end) minutes of the week.
+
+    "00:00"-"00:00" means closed that day; a close before the open runs past midnight.
+    """
+    intervals = []
+    for index, day in enumerate(DAYS):
+        today = hours.get(day)
+        if not today or (today['open'] == "00:00" and today['close'] == "00:00"):
+            continue
+        start = index * 24 * 60 + toMinutes(today['open'])
+        end = index * 24 * 60 + toMinutes(today['close'])
+        if end <= start:
+            end += 24 * 60
+        intervals.append((start, end))
+    return sorted(intervals)
+
+class HoursIndex:
+    """hours.json loaded once and keyed by normalized location name.
+
+    The file is re-read automatically when its modification time changes.
+    """
+
+    def __init__(self, path=HOURS_FILE):
+        self.path = path
+        self.mtime = None
+        self.locations = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Reload the file if it changed. Raises FileNotFoundError or json.JSONDecodeError."""
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.locations = {
+                normalize(loc['name']): dict(loc, intervals=openIntervals(loc['hours']))
+                for loc in data['locations']
+            }
+            self.mtime = mtime
+
+    def get(self, name):
+        """The hours.json entry for a location, or None."""
+        self.refresh()
+        return self.locations.get(normalize(name))
+
+    def status(self, name, now=None):
+        loc = self.get(name)
+        return statusFor(loc, now or datetime.now(ARIZONA_TZ)) if loc else None
+
+    def statuses(self, now=None):
+        """Open/closed status for every location at once."""
+        self.refresh()
+        now = now or datetime.now(ARIZONA_TZ)
+        return [statusFor(loc, now) for loc in self.locations.values()]
+
+def statusFor(loc, now):
+    """Whether loc is open at now, and minutes until it closes or next opens."""
+    minute = weekMinute(now)
+    status = {'name': loc['name'], 'open': False, 'minutesUntilOpen': None, 'minutesUntilClose': None,
+              'hours': loc['hours']}
+    for start, end in loc['intervals']:
+        # Check both this week and the tail of last week's interval that runs past Sunday night
+        for offset in (0, -WEEK_MINUTES):
+            if start + offset <= minute < end + offset:
+                status['open'] = True
+                status['minutesUntilClose'] = end + offset - minute
+                return status
+    if loc['intervals']:
+        status['minutesUntilOpen'] = min((start - minute) % WEEK_MINUTES for start, _ in loc['intervals'])
+    return status
+
+hours_index = HoursIndex()
@@ -0,0 +1,104 @@
+import os
+import re
+import glob
+import hashlib
+import threading
+from Metrics import metrics
+
+IMAGE_PATH = './static'
+# Width of the WebP thumbnails shown in the sidebar (320px wide, so this covers 2x screens)
+THUMBNAIL_WIDTH = 640
+WEBP_QUALITY = 80
+# Versions of each camera's image kept on disk, so a page still showing the previous URL can load it
+KEEP_VERSIONS = 2
+# Seconds browsers may cache a content-hash image; a new frame always gets a new URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+VERSIONED_NAME = re.compile(r'\.[0-9a-f]{16}(\.thumb)?\.(jpg|webp)$')
+
+images_written = metrics.counter('foodcameras_images_written_total', 'Annotated images and thumbnails written', ['kind'])
+
+def contentHash(content):
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+def thumbnailName(name):
+    """'12_Cafe.<hash>.jpg' -> '12_Cafe.<hash>.thumb.webp'"""
+    return os.path.splitext(name)[0] + '.thumb.webp'
+
+def isVersioned(name):
+    """Whether an image name carries a content hash, i.e. its bytes can never change."""
+    return VERSIONED_NAME.search(name) is not None
+
+class ImageStore:
+    """Writes each camera's annotated frame under a content-hash name, with a WebP thumbnail beside it.
+
+    Since a name only ever holds one set of bytes, the API serves them with a year-long
+    immutable Cache-Control and browsers never revalidate. Each camera keeps its last
+    KEEP_VERSIONS images; older ones are deleted as new ones are saved.
+    """
+
+    def __init__(self, path=IMAGE_PATH, keep=KEEP_VERSIONS, thumbnail_width=THUMBNAIL_WIDTH):
+        self.path = path
+        self.keep = keep
+        self.thumbnail_width = thumbnail_width
+        self.versions = {}
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, content, kind):
+        path = os.path.join(self.path, name)
+        if os.path.exists(path):
+            # Same name, same bytes
+            return
+        # Written under a temporary name first, so a request never sees half an image
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, path)
+        images_written.inc(kind=kind)
+
+    def save(self, prefix, image):
+        """Encode a frame and its thumbnail; returns the image name to store on the camera."""
+        import cv2
+        ok, jpeg = cv2.imencode('.jpg', image)
+        if not ok:
+            raise ValueError("Failed to encode image")
+        height, width = image.shape[:2]
+        thumbnail = image
+        if width > self.thumbnail_width:
+            thumbnail = cv2.resize(image, (self.thumbnail_width, round(height * self.thumbnail_width / width)),
+                                   interpolation=cv2.INTER_AREA)
+        ok, webp = cv2.imencode('.webp', thumbnail, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+        if not ok:
+            raise ValueError("Failed to encode thumbnail")
+
+        name = f"{prefix}.{contentHash(jpeg)}.jpg"
+        self.write(thumbnailName(name), webp.tobytes(), 'thumbnail')
+        self.write(name, jpeg.tobytes(), 'full')
+        self.prune(prefix, name)
+        return name
+
+    def prune(self, prefix, name):
+        """Record name as the newest version of prefix and delete the versions past KEEP_VERSIONS."""
+        with self.lock:
+            versions = self.versions.get(prefix)
+            if versions is None:
+                # First save since startup: pick up what earlier runs left behind, oldest first
+                found = glob.glob(os.path.join(glob.escape(self.path), glob.escape(prefix) + '.*'))
+                versions = self.versions[prefix] = [
+                    os.path.basename(path) for path in sorted(found, key=os.path.getmtime)
+                    if not path.endswith(('.thumb.webp', '.tmp'))
+                ]
+            if name in versions:
+                versions.remove(name)
+            versions.append(name)
+            stale = versions[:-self.keep]
+            del versions[:-self.keep]
+        for old in stale:
+            for path in (old, thumbnailName(old)):
+                try:
+                    os.remove(os.path.join(self.path, path))
+                except FileNotFoundError:
+                    pass
+
+image_store = ImageStore()
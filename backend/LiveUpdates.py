@@ -0,0 +1,70 @@
+import json
+import threading
+from collections import deque
+from Metrics import metrics
+
+# Deltas kept so a client that reconnects with Last-Event-ID can catch up
+HISTORY = 32
+# Seconds between keep-alive comments on an idle stream; also how soon a dropped client is noticed
+HEARTBEAT_SECONDS = 25
+# Milliseconds the browser waits before reconnecting
+RETRY_MILLISECONDS = 5000
+
+class UpdateHub:
+    """Fans each sweep's delta out to every connected Server-Sent Events client.
+
+    A delta is serialized once when it is published and every stream sends the same
+    text. Idle streams block on one shared condition, so they cost a waiting thread
+    and nothing else until the next sweep commits.
+    """
+
+    def __init__(self, history=HISTORY):
+        self.events = deque(maxlen=history)
+        self.sequence = 0
+        self.listeners = 0
+        self.condition = threading.Condition()
+
+    def publish(self, delta):
+        """Send a delta of changed locations to every listener."""
+        data = json.dumps(delta, separators=(',', ':'))
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, f"id: {self.sequence}\nevent: delta\ndata: {data}\n\n"))
+            self.condition.notify_all()
+
+    def pending(self, cursor):
+        """Events after cursor, and whether the client missed some that are no longer kept."""
+        if cursor > self.sequence:
+            # The server restarted since the client's last event
+            return [], True
+        oldest = self.events[0][0] if self.events else self.sequence + 1
+        return [event for event in self.events if event[0] > cursor], cursor + 1 < oldest
+
+    def stream(self, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+        """Generator of SSE text for one client, starting after last_event_id (or now)."""
+        cursor = self.sequence if last_event_id is None else last_event_id
+        with self.condition:
+            self.listeners += 1
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                with self.condition:
+                    if cursor == self.sequence:
+                        self.condition.wait(heartbeat)
+                    events, missed = self.pending(cursor)
+                    sequence = self.sequence
+                if missed:
+                    # Too far behind to replay; the client reloads everything instead
+                    cursor = sequence
+                    yield f"id: {sequence}\nevent: reset\ndata: {{}}\n\n"
+                elif events:
+                    cursor = events[-1][0]
+                    yield ''.join(text for _, text in events)
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self.condition:
+                self.listeners -= 1
+
+live_updates = UpdateHub()
+metrics.callback('foodcameras_live_listeners', 'Open /api/live event streams', 'gauge', lambda: live_updates.listeners)
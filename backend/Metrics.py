@@ -0,0 +1,138 @@
+import bisect
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, from a fast route to a full sweep
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatLabels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A monotonically increasing count per label set."""
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{formatLabels(self.labels, key)} {formatValue(value)}"
+
+class Histogram:
+    """Observations counted into fixed buckets per label set, plus their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        # Only the bucket the value falls in is counted here; render() makes them cumulative
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent inside the with block."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket{formatLabels(self.labels, key, [('le', formatValue(bound))])} {cumulative}"
+            yield f"{self.name}_sum{formatLabels(self.labels, key)} {formatValue(total)}"
+            yield f"{self.name}_count{formatLabels(self.labels, key)} {count}"
+
+class Callback:
+    """A value read from elsewhere (e.g. a cache's hit counter) when the metrics are scraped."""
+
+    def __init__(self, name, help, type, read):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.read = read
+
+    def samples(self):
+        yield f"{self.name} {formatValue(self.read())}"
+
+class Metrics:
+    """Registry of the process's counters and histograms, rendered in the Prometheus text format.
+
+    Metrics are plain in-memory counts behind a lock per metric, cheap enough to leave on.
+    The sweep runs in the API process, so /metrics covers both the routes and the sweep;
+    detector workers report their timings back with each batch.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            # Re-registering returns the existing metric, so modules can be reloaded safely
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, type, read):
+        return self.register(Callback(name, help, type, read))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# Time spent in each stage of a sweep: listing, download, decode, inference, encode, commit and the whole sweep
+stage_seconds = metrics.histogram('foodcameras_sweep_stage_seconds', 'Seconds spent per sweep stage', ['stage'])
@@ -0,0 +1,41 @@
+from peewee import *
+from Core import Camera, Location, LocationSnapshot, db
+from Analytics import Analytics, Frames, HourlyAnalytics, DailyAnalytics, migrateFrames, rebuildFrames, rebuildRollups
+from SweepWriter import refreshSnapshots
+
+def dedupeAnalytics():
+    """Delete repeated (cameraId, timestamp) samples, keeping the first one stored."""
+    first = (Analytics
+             .select(fn.MIN(Analytics.id))
+             .group_by(Analytics.cameraId, Analytics.timestamp))
+    return Analytics.delete().where(Analytics.id.not_in(first)).execute()
+
+def migrateDatabase():
+    """Bring an existing database.db up to the current schema without losing data.
+
+    Adds missing columns and tables, removes duplicate Analytics samples so the
+    unique (cameraId, timestamp) index can be created, and creates every index the
+    models declare. Safe to run repeatedly.
+    """
+    with db.connection_context():
+        # A fresh database has nothing to migrate; create_tables builds it below
+        if Analytics.table_exists():
+            with db.atomic():
+                removed = dedupeAnalytics()
+            if removed:
+                print(f"Removed {removed} duplicate analytics rows")
+        if Frames.table_exists() and migrateFrames():
+            rebuildFrames()
+        missing_rollups = not HourlyAnalytics.table_exists()
+        missing_snapshots = not LocationSnapshot.table_exists()
+        db.create_tables([Location, Camera, LocationSnapshot, Analytics, Frames, HourlyAnalytics, DailyAnalytics],
+                         safe=True)
+        if missing_rollups:
+            rebuildRollups()
+        if missing_snapshots:
+            with db.atomic():
+                print(f"Built {len(refreshSnapshots())} location snapshots")
+    print("Database schema is up to date")
+
+if __name__ == "__main__":
+    migrateDatabase()
@@ -0,0 +1,74 @@
+import threading
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from Metrics import metrics
+
+# Most responses kept before the least recently used one is evicted
+MAX_ENTRIES = 256
+
+class ResponseCache:
+    """LRU cache of serialized JSON responses, invalidated by bumping a generation counter.
+
+    The sweep bumps the generation after it commits, so every cached response from an
+    older generation is treated as a miss and rebuilt from the database.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return (body, etag) for key if it was cached in the current generation."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != self.generation:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, body, generation):
+        """Store a body built while generation was current; returns its etag."""
+        etag = hashlib.md5(body).hexdigest()
+        with self.lock:
+            if generation != self.generation:
+                return etag
+            self.entries[key] = (generation, body, etag)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return etag
+
+    def bump(self):
+        """Invalidate every cached response; called after the database changes."""
+        with self.lock:
+            self.generation += 1
+            self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'generation': self.generation
+            }
+
+response_cache = ResponseCache()
+metrics.callback('foodcameras_response_cache_hits_total', 'API responses served from the response cache',
+                 'counter', lambda: response_cache.hits)
+metrics.callback('foodcameras_response_cache_misses_total', 'API responses rebuilt from the database',
+                 'counter', lambda: response_cache.misses)
@@ -0,0 +1,124 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from Core import Location, db
+from Hours import hours_index, ARIZONA_TZ, toMinutes
+from Metrics import metrics
+
+# Minutes between sweeps of an open location outside its busy periods
+BASE_INTERVAL = 15
+# Minutes between sweeps around opening, closing and meal peaks
+PEAK_INTERVAL = 10
+# How long after opening and before closing counts as busy
+EDGE_MINUTES = 30
+# Local-time meal rushes sampled at PEAK_INTERVAL
+MEAL_PEAKS = [("11:00", "13:30"), ("17:00", "19:00")]
+# Longest the scheduler sleeps before re-reading the hours
+MAX_SLEEP_SECONDS = 300
+# Seconds to wait after a failed sweep before trying again
+RETRY_SECONDS = 60
+
+sweep_failures = metrics.counter('foodcameras_sweep_failures_total', 'Sweeps or after-sweep steps that raised',
+                                 ['stage'])
+
+def sweepInterval(status, now):
+    """Minutes until a location should be swept again, from its hours status.
+
+    Closed locations wait until they open (None when they never open); open ones
+    are sampled more often near opening, closing and meal peaks.
+    """
+    if status is None:
+        return BASE_INTERVAL
+    if not status['open']:
+        return status['minutesUntilOpen']
+    today = status['hours'].get(now.strftime('%A'), {})
+    minute = now.hour * 60 + now.minute
+    opened = today.get('open') and minute - toMinutes(today['open']) < EDGE_MINUTES
+    closing = status['minutesUntilClose'] <= EDGE_MINUTES
+    peak = any(toMinutes(start) <= minute < toMinutes(end) for start, end in MEAL_PEAKS)
+    return PEAK_INTERVAL if opened or closing or peak else BASE_INTERVAL
+
+class SweepScheduler:
+    """Decides which locations each sweep covers and when the next sweep starts.
+
+    Sweeps run one at a time; a sweep that overruns delays the next one rather than
+    overlapping it.
+    """
+
+    def __init__(self, sweep, hours=hours_index):
+        self.sweep = sweep
+        self.hours = hours
+        self.next_due = {}
+        self.lock = threading.Lock()
+
+    def locationNames(self):
+        with db.connection_context():
+            return {location.name for location in Location.select(Location.name)}
+
+    def due(self, now):
+        """Location names whose next sweep time has passed."""
+        return {name for name in self.locationNames() if self.next_due.get(name, now) <= now}
+
+    def schedule(self, names, now):
+        for name in names:
+            try:
+                status = self.hours.status(name, now)
+            except (OSError, ValueError) as e:
+                print(f"Could not read hours for {name}: {e}")
+                status = None
+            minutes = sweepInterval(status, now)
+            # Locations that never open are checked again once the hours could have changed
+            self.next_due[name] = now + timedelta(minutes=minutes if minutes is not None else 24 * 60)
+
+    def runOnce(self, now=None):
+        """Sweep every due location. Returns the sweep's stats, or None if nothing ran."""
+        if not self.lock.acquire(blocking=False):
+            print("Previous sweep still running, skipping")
+            return None
+        try:
+            now = now or datetime.now(ARIZONA_TZ)
+            due = self.due(now)
+            open_now = set()
+            for name in due:
+                try:
+                    status = self.hours.status(name, now)
+                except (OSError, ValueError):
+                    status = None
+                if status is None or status['open']:
+                    open_now.add(name)
+            self.schedule(due, now)
+            if not open_now:
+                return None
+            print(f"Sweeping {len(open_now)} open locations, skipping {len(due) - len(open_now)} closed")
+            return self.sweep(open_now)
+        finally:
+            self.lock.release()
+
+    def secondsUntilNext(self, now=None):
+        now = now or datetime.now(ARIZONA_TZ)
+        if not self.next_due:
+            return 0
+        wait = (min(self.next_due.values()) - now).total_seconds()
+        return min(max(wait, 0), MAX_SLEEP_SECONDS)
+
+    def run(self, after_sweep=None):
+        """Sweep forever, sleeping until the next location is due.
+
+        A sweep that raises (a locked database, say) is logged and retried after
+        RETRY_SECONDS instead of ending the thread.
+        """
+        while True:
+            sleep = None
+            try:
+                stats = self.runOnce()
+                if stats is not None and after_sweep:
+                    try:
+                        after_sweep(stats)
+                    except Exception as e:
+                        sweep_failures.inc(stage='after_sweep')
+                        print(f"After-sweep step failed: {e!r}")
+            except Exception as e:
+                sweep_failures.inc(stage='sweep')
+                print(f"Sweep failed, retrying in {RETRY_SECONDS}s: {e!r}")
+                sleep = RETRY_SECONDS
+            time.sleep(sleep or max(self.secondsUntilNext(), 1))
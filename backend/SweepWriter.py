@@ -0,0 +1,163 @@
+import time
+from peewee import *
+from Core import Camera, Location, LocationSnapshot, db
+from ResponseCache import response_cache
+from Metrics import metrics, stage_seconds
+from LiveUpdates import live_updates
+from Analytics import insertAnalytics, frameRows, upsertFrames, upsertRollups
+
+def calculate_busy_level(num_people):
+    if num_people == 0:
+        return "Empty"
+    elif num_people < 5:
+        return "Low"
+    elif num_people < 15:
+        return "Medium"
+    else:
+        return "High"
+
+rows_written = metrics.counter('foodcameras_sweep_rows_written_total', 'Rows written by sweep commits')
+
+def refreshSnapshots(names=None, batch_size=100):
+    """Recompute the LocationSnapshot of the named locations (all by default) from their cameras.
+
+    A location's traffic level comes from the total across its cameras. Returns the rows written.
+    """
+    totals = (Camera
+              .select(Camera.locationName,
+                      fn.SUM(Camera.peopleCount).alias('total'),
+                      fn.MAX(Camera.peopleCount).alias('most'),
+                      fn.COUNT(Camera.cameraId).alias('cameras'),
+                      fn.MAX(Camera.timestamp).alias('timestamp'))
+              .group_by(Camera.locationName))
+    # Some locations have a Location row per camera; they share one snapshot
+    locations = (Location
+                 .select(fn.MIN(Location.id).alias('locationId'), Location.name, Location.building,
+                         Location.longitude, Location.latitude, Location.trafficLevel)
+                 .group_by(Location.name))
+    if names is not None:
+        totals = totals.where(Camera.locationName.in_(list(names)))
+        locations = locations.where(Location.name.in_(list(names)))
+    totals = {row['locationName']: row for row in totals.dicts()}
+
+    rows = []
+    for location in locations.dicts():
+        location.update(peopleCount=0, maxCount=0, cameras=0, timestamp=None)
+        total = totals.get(location['name'])
+        if total is not None:
+            location.update(trafficLevel=calculate_busy_level(total['total']), peopleCount=total['total'],
+                            maxCount=total['most'], cameras=total['cameras'], timestamp=total['timestamp'])
+        rows.append(location)
+    fields = [LocationSnapshot.locationId, LocationSnapshot.building, LocationSnapshot.longitude,
+              LocationSnapshot.latitude, LocationSnapshot.trafficLevel, LocationSnapshot.peopleCount,
+              LocationSnapshot.maxCount, LocationSnapshot.cameras, LocationSnapshot.timestamp]
+    for batch in chunked(rows, batch_size):
+        (LocationSnapshot
+         .insert_many(batch)
+         .on_conflict(conflict_target=[LocationSnapshot.name], preserve=fields)
+         .execute())
+    return rows
+
+class SweepWriter:
+    """Collects every camera result from a sweep and writes them to the database in one transaction.
+
+    Replaces the per-camera pushCamera/pushTraffic/pushFrame/pushAnalytics calls, which each
+    opened a connection, looked a row up and committed on their own.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.results = []
+        self.images = {}
+        self.changes = {}
+
+    def add(self, data):
+        self.results.append(dict(data))
+
+    def image(self, camera_id, name):
+        """Point a camera at its newly saved image; cameras without one keep their current image."""
+        self.images[camera_id] = name
+
+    def commit(self):
+        """Apply all collected results, then push what changed to live clients.
+
+        Returns the number of rows written, the changed locations and the commit time.
+        """
+        start = time.perf_counter()
+        rows = 0
+        if self.results:
+            with db.connection_context():
+                with db.atomic():
+                    rows += self.writeCameras()
+                    rows += self.writeLocations()
+                    rows += self.writeAnalytics()
+            # Cached API responses are stale once the sweep is committed
+            response_cache.bump()
+            if self.changes:
+                live_updates.publish({'locations': list(self.changes.values())})
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, stage='commit')
+        rows_written.inc(rows)
+        print(f"Sweep commit: {rows} rows for {len(self.results)} cameras in {seconds:.3f}s")
+        stats = {'cameras': len(self.results), 'rows': rows, 'changedLocations': len(self.changes),
+                 'commitSeconds': seconds}
+        self.results = []
+        self.images = {}
+        self.changes = {}
+        return stats
+
+    def latest(self):
+        """Last result per camera, in the order cameras were processed."""
+        return {data['id']: data for data in self.results}
+
+    def changed(self, location_name):
+        """The delta entry for a location, created on first change."""
+        return self.changes.setdefault(location_name, {'name': location_name})
+
+    def writeCameras(self):
+        latest = self.latest()
+        cameras = list(Camera.select().where(Camera.cameraId.in_(list(latest))))
+        for camera in cameras:
+            data = latest[camera.cameraId]
+            image = self.images.get(camera.cameraId, camera.image)
+            if camera.peopleCount != data['peopleCount'] or camera.image != image:
+                self.changed(camera.locationName).setdefault('cameras', []).append(
+                    {'cameraId': camera.cameraId, 'peopleCount': data['peopleCount'], 'image': image})
+            camera.peopleCount = data['peopleCount']
+            camera.timestamp = data['timestamp']
+            camera.image = image
+        if cameras:
+            Camera.bulk_update(cameras, fields=[Camera.peopleCount, Camera.timestamp, Camera.image],
+                               batch_size=self.batch_size)
+        return len(cameras)
+
+    def writeLocations(self):
+        """Recompute the snapshot of every location in the sweep, over all of its cameras."""
+        names = {camera.locationName for camera in
+                 Camera.select(Camera.locationName).where(Camera.cameraId.in_(list(self.latest())))}
+        before = {snapshot.name: snapshot for snapshot in
+                  LocationSnapshot.select().where(LocationSnapshot.name.in_(list(names)))}
+        snapshots = refreshSnapshots(names, self.batch_size)
+        names_by_level = {}
+        for snapshot in snapshots:
+            previous = before.get(snapshot['name'])
+            if (previous is None or previous.trafficLevel != snapshot['trafficLevel'] or
+                    previous.peopleCount != snapshot['peopleCount']):
+                self.changed(snapshot['name']).update(trafficLevel=snapshot['trafficLevel'],
+                                                      peopleCount=snapshot['peopleCount'],
+                                                      maxCount=snapshot['maxCount'])
+            names_by_level.setdefault(snapshot['trafficLevel'], []).append(snapshot['name'])
+        # Location.trafficLevel is kept in step for anything still reading it
+        for level, level_names in names_by_level.items():
+            Location.update(trafficLevel=level).where(Location.name.in_(level_names)).execute()
+        return len(snapshots)
+
+    def writeAnalytics(self):
+        """Insert new samples and fold the ones the database accepted into Frames and the rollups."""
+        rows = [{'cameraId': data['id'], 'timestamp': data['timestamp'], 'peopleCount': data['peopleCount']}
+                for data in self.results]
+        # Duplicate (cameraId, timestamp) samples are dropped by the unique index
+        inserted = insertAnalytics(rows, self.batch_size)
+        frames = upsertFrames(frameRows(inserted), self.batch_size)
+        rollups = upsertRollups(inserted, self.batch_size)
+        return len(inserted) + frames + rollups
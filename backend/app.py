@@ -1,31 +1,105 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, g
+from functools import wraps
 from flask_cors import CORS
 import os
 import json
-from Core import db, Location, Camera
-from Analytics import Analytics, Frames, weekday, frameStart
-from datetime import datetime, time
-from CountPeople import process_locations
+from Core import db, Location, Camera, LocationSnapshot
+from Analytics import locationFrames, history, compactAnalytics, ARIZONA_TZ
+from Migrate import migrateDatabase
+from ResponseCache import response_cache
+from Hours import hours_index
+from Scheduler import SweepScheduler
+from datetime import datetime, time, timedelta
+from FrameCache import frame_cache
+from CircuitBreaker import camera_breaker
+from LiveUpdates import live_updates
+from Forecast import forecaster
+from Metrics import metrics
+from ImageStore import IMAGE_PATH, IMMUTABLE_MAX_AGE, isVersioned, thumbnailName
+from werkzeug.utils import safe_join
+from time import perf_counter
 import threading
-import time as timeforsleeping
 
 app = Flask(__name__)
 CORS(app)
 
+request_seconds = metrics.histogram('foodcameras_http_request_seconds', 'Seconds spent serving API requests',
+                                    ['route', 'method', 'status'])
+
+@app.before_request
+def startTimer():
+    g.start = perf_counter()
+
+@app.after_request
+def recordRequest(response):
+    # Label by the route pattern, not the URL, so location names don't create new series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(perf_counter() - g.start, route=route, method=request.method,
+                            status=str(response.status_code))
+    return response
+
+def cached(view):
+    """Serve the view's JSON from response_cache until the next sweep commits.
+
+    Responses carry ETag and Last-Modified so the frontend can revalidate and get a 304.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.full_path
+        entry = response_cache.get(key)
+        if entry is None:
+            generation = response_cache.generation
+            result = view(*args, **kwargs)
+            if isinstance(result, tuple) or result.status_code != 200:
+                return result
+            body = result.get_data()
+            entry = body, response_cache.put(key, body, generation)
+        body, etag = entry
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.last_modified = response_cache.modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
 @app.route('/api/locations', methods=['GET'])
+@cached
 def get_locations():
+    """Every location with its cameras' combined counts, read from the snapshot the sweep writes"""
     with db.connection_context():
-        locations = Location.select().dicts()
+        locations = (LocationSnapshot
+                     .select(LocationSnapshot.locationId.alias('id'), LocationSnapshot.name, LocationSnapshot.building,
+                             LocationSnapshot.longitude, LocationSnapshot.latitude, LocationSnapshot.trafficLevel,
+                             LocationSnapshot.peopleCount, LocationSnapshot.maxCount, LocationSnapshot.cameras,
+                             LocationSnapshot.timestamp)
+                     .order_by(LocationSnapshot.locationId)
+                     .dicts())
         return jsonify(list(locations))
 
 @app.route('/api/image/<path:image_name>', methods=['GET'])
 def get_image(image_name):
-    image_path = os.path.join('./static', image_name)
-    if os.path.exists(image_path):
-        return send_file(image_path, mimetype='image/jpeg')
-    return jsonify({"error": "Image not found"}), 404
+    """A camera's annotated image; ?size=thumb gives the WebP thumbnail for the sidebar"""
+    if request.args.get('size') == 'thumb':
+        thumbnail = safe_join(IMAGE_PATH, thumbnailName(image_name))
+        if thumbnail and os.path.isfile(thumbnail):
+            image_name = thumbnailName(image_name)
+    image_path = safe_join(IMAGE_PATH, image_name)
+    if image_path is None or not os.path.isfile(image_path):
+        return jsonify({"error": "Image not found"}), 404
+    # send_file would resolve a relative path against the app's folder rather than the working directory
+    image_path = os.path.abspath(image_path)
+    if not isVersioned(image_name):
+        # Images from before content-hash names can change under the same URL
+        response = send_file(image_path)
+        response.cache_control.no_cache = True
+        return response
+    response = send_file(image_path, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/location/<location_name>', methods=['GET'])
+@cached
 def get_location(location_name):
     with db.connection_context():
         try:
@@ -36,18 +110,17 @@ def get_location(location_name):
             return jsonify({"error": "Location not found"}), 404
 
 @app.route('/api/analytics/<location_name>/<weekday>', methods=['GET'])
+@cached
 def get_analytics(location_name, weekday):
     with db.connection_context():
         try:
             location = Location.get(Location.name == location_name)
-            cameras = list(Camera.select().where(Camera.locationName == location.name).dicts())
-            if not cameras:
+            camera_ids = [camera.cameraId for camera in
+                          Camera.select(Camera.cameraId).where(Camera.locationName == location.name)]
+            if not camera_ids:
                 return jsonify({"error": "No cameras found for this location"}), 404
-            frames = list(Frames.select()
-                           .where((Frames.cameraId == cameras[0]['cameraId']) & (Frames.weekday == weekday))
-                           .order_by(Frames.frameStart.desc())
-                           .limit(200)
-                           .dicts())
+            # Every camera at the location counts, not just the first one
+            frames = locationFrames(camera_ids, weekday)
         except Location.DoesNotExist:
             return jsonify({"error": "Location not found"}), 404
     
@@ -57,36 +130,146 @@ def get_analytics(location_name, weekday):
                 frame[key] = value.strftime("%H:%M")
     return jsonify(frames)
 
+def parseHistoryTime(value, default):
+    """Parse a from/to query value; naive values are Arizona local time."""
+    if not value:
+        return default
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = ARIZONA_TZ.localize(moment)
+    return moment
+
+@app.route('/api/history/<location_name>', methods=['GET'])
+def get_history(location_name):
+    """People counts for a location over ?from=&to= (ISO dates) at ?resolution=raw|hour|day|auto"""
+    try:
+        end = parseHistoryTime(request.args.get('to'), datetime.now(ARIZONA_TZ))
+        start = parseHistoryTime(request.args.get('from'), end - timedelta(days=7))
+    except ValueError:
+        return jsonify({"error": "from and to must be ISO-8601 dates"}), 400
+    if start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+
+    with db.connection_context():
+        camera_ids = [camera.cameraId for camera in Camera.select(Camera.cameraId).where(Camera.locationName == location_name)]
+    if not camera_ids:
+        return jsonify({"error": "Location not found"}), 404
+
+    try:
+        resolution, points = history(camera_ids, start, end, request.args.get('resolution', 'auto'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "location": location_name,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "resolution": resolution,
+        "points": points
+    })
+
+@app.route('/api/forecast/<location_name>', methods=['GET'])
+def get_forecast(location_name):
+    """Predicted people counts for the next few hours, precomputed after the last sweep"""
+    if not forecaster.ready():
+        return jsonify({"error": "Forecast not ready yet"}), 503
+    forecast = forecaster.forecast(location_name)
+    if forecast is None:
+        return jsonify({"error": "Location not found"}), 404
+    return jsonify(forecast)
+
 @app.route('/api/hours/<location>', methods=['GET'])
 def get_hours(location):
     """Fetches operating hours for a given location from hours.json"""
     try:
-        with open('hours.json', 'r') as f:
-            data = json.load(f)
+        loc = hours_index.get(location)
+        if loc is None:
+            return jsonify({"error": "Location hours not found"}), 404
+        return jsonify(loc["hours"])
 
-        for loc in data["locations"]:
-            if loc["name"].lower() == location.lower():
-                return jsonify(loc["hours"])
-
-        return jsonify({"error": "Location hours not found"}), 404
+    except FileNotFoundError:
+        return jsonify({"error": "hours.json file not found"}), 500
+    except json.JSONDecodeError:
+        return jsonify({"error": "Error decoding hours.json"}), 500
 
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Open/closed status, minutes until opening or closing, and hours for every location"""
+    try:
+        return jsonify(hours_index.statuses())
     except FileNotFoundError:
         return jsonify({"error": "hours.json file not found"}), 500
     except json.JSONDecodeError:
         return jsonify({"error": "Error decoding hours.json"}), 500
 
-def countPeopleEvery15Minutes():
-    minutes = 15
-    while True:
-        process_locations()        
-        timeforsleeping.sleep(minutes * 60)
+@app.route('/api/live', methods=['GET'])
+def get_live_updates():
+    """Server-Sent Events stream of the locations each sweep changed"""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    stream = live_updates.stream(int(last_event_id) if last_event_id.isdigit() else None)
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/framecache', methods=['GET'])
+def get_frame_cache():
+    """Hit/miss counts for the unchanged-frame cache used by the sweep"""
+    return jsonify(frame_cache.stats())
+
+@app.route('/api/cameras/health', methods=['GET'])
+def get_camera_health():
+    """Cameras that failed recently, their last error and whether sweeps are skipping them"""
+    return jsonify(camera_breaker.stats())
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache():
+    """Hit/miss counts for the API response cache"""
+    return jsonify(response_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request, sweep stage and cache metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def refreshForecast():
+    try:
+        forecaster.refresh()
+    except Exception as e:
+        print(f"Forecast refresh failed: {e}")
+
+# Raw rows expire by the day, so compaction runs once a day instead of after every sweep
+COMPACT_INTERVAL = timedelta(days=1)
+last_compaction = None
+
+def compactDaily():
+    global last_compaction
+    now = datetime.now(ARIZONA_TZ)
+    if last_compaction is not None and now - last_compaction < COMPACT_INTERVAL:
+        return
+    last_compaction = now
+    if compactAnalytics():
+        response_cache.bump()
+
+def afterSweep(stats):
+    compactDaily()
+    refreshForecast()
+
+def countPeopleOnSchedule():
+    """Sweep open locations on the hours-based schedule"""
+    # Imported here so cv2 and the detector stay off the API's import path
+    from CountPeople import process_locations
+    # Fit once up front so forecasts are served before the first sweep finishes
+    refreshForecast()
+    SweepScheduler(process_locations).run(afterSweep)
 
 def start_background_task():
-    thread = threading.Thread(target=countPeopleEvery15Minutes, daemon=True)
+    thread = threading.Thread(target=countPeopleOnSchedule, daemon=True)
     thread.start()
 
 if __name__ == '__main__':
-    with db.connection_context():
-        pass  # Ensure the database is initialized properly before starting
-    start_background_task()
-    app.run(debug=True)
+    debug = True
+    # The debug reloader runs this block twice: in a watcher process and in the process that
+    # serves requests. Only the serving one migrates and sweeps, so there is one scheduler,
+    # one detector pool, and its commits reach this process's response cache and live clients.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        migrateDatabase()  # Add any columns and indexes missing from an older database.db
+        start_background_task()
+    app.run(debug=debug)
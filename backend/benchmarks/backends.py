@@ -0,0 +1,100 @@
+"""Compare detector backends on a stored image set.
+
+For every backend this measures per-batch latency, throughput and how closely its
+person counts agree with the first backend listed (the eager torch model by default).
+Export the models first with `python Backends.py export onnx` etc.
+
+Run from backend/:
+    python benchmarks/backends.py IMAGE_DIR [--backends torch,torchscript,onnx,int8]
+        [--size 640] [--threads 4] [--batch 8] [--tolerance 1] [--output backends.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+from Detect import personBoxes, BATCH_SIZE, PERSON_CLASS, DETECT_THRESHOLD
+from Backends import createDetector, INPUT_SIZE
+
+# Same confidence the sweep uses
+THRESHOLD = DETECT_THRESHOLD
+
+def loadImages(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            image = cv2.imread(os.path.join(directory, name))
+            if image is not None:
+                images.append(image)
+    return images
+
+def run(backend, images, size, threads, batch_size):
+    """Counts per image plus timing for one backend."""
+    detector = createDetector(backend, size, threads)
+    detector.predict(images[:batch_size], classes=[PERSON_CLASS], confidence=THRESHOLD)  # warm up
+    counts, latencies = [], []
+    start = time.perf_counter()
+    for offset in range(0, len(images), batch_size):
+        chunk = images[offset:offset + batch_size]
+        batch_start = time.perf_counter()
+        predictions = detector.predict(chunk, classes=[PERSON_CLASS], confidence=THRESHOLD)
+        latencies.append(time.perf_counter() - batch_start)
+        counts.extend(len(personBoxes(p, image, THRESHOLD)) for p, image in zip(predictions, chunk))
+    total = time.perf_counter() - start
+    return counts, {
+        'batchLatencyMedianSeconds': statistics.median(latencies),
+        'batchLatencyMaxSeconds': max(latencies),
+        'imagesPerSecond': len(images) / total,
+        'totalPeople': sum(counts),
+    }
+
+def agreement(counts, reference, tolerance):
+    errors = [abs(a - b) for a, b in zip(counts, reference)]
+    return {
+        'meanAbsCountError': statistics.mean(errors),
+        'maxCountError': max(errors),
+        'withinTolerance': sum(error <= tolerance for error in errors) / len(errors),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images')
+    parser.add_argument('--backends', default='torch,torchscript,onnx,int8')
+    parser.add_argument('--size', type=int, default=INPUT_SIZE)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--tolerance', type=int, default=1, help='allowed person-count difference per image')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    images = loadImages(args.images)
+    if not images:
+        parser.error(f"No images found in {args.images}")
+
+    results = {'images': len(images), 'size': args.size, 'threads': args.threads, 'batch': args.batch, 'backends': {}}
+    reference = None
+    for backend in args.backends.split(','):
+        try:
+            counts, stats = run(backend, images, args.size, args.threads, args.batch)
+        except Exception as e:
+            results['backends'][backend] = {'error': str(e)}
+            continue
+        if reference is None:
+            reference = counts
+        stats.update(agreement(counts, reference, args.tolerance))
+        results['backends'][backend] = stats
+        print(f"{backend}: {stats['imagesPerSecond']:.1f} images/s, {stats['withinTolerance']:.0%} within tolerance")
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""A local stand-in for the GCU linecam API, for benchmarks and offline sweeps.
+
+Serves the same three shapes the sweep reads: the building list at /locations, the
+camera listing at /images?location=BUILDING and the camera JPEGs themselves. Camera
+frames are recorded JPEGs from a directory, handed out round-robin, so any number of
+simulated cameras can be served from a handful of real images.
+
+Every camera set is mounted under its own prefix (/cameras/<n>), so one server can
+back sweeps of several sizes:
+
+    server = FakeLinecam(images)
+    os.environ['LINECAM_API_URL'] = server.url(100)
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+# How the simulated cameras are grouped, roughly like the real campus
+CAMERAS_PER_LOCATION = 2
+LOCATIONS_PER_BUILDING = 5
+
+def cameraLayout(count):
+    """Deterministic (building, location, camera id) for count simulated cameras."""
+    layout = []
+    for i in range(count):
+        location = i // CAMERAS_PER_LOCATION
+        building = location // LOCATIONS_PER_BUILDING
+        layout.append((f"Building {building}", f"Location {location}", i + 1))
+    return layout
+
+def loadJpegs(directory=None, count=8):
+    """Raw JPEG bytes from a directory of recorded frames, or synthetic frames if there is none."""
+    jpegs = []
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    jpegs.append(f.read())
+    if not jpegs:
+        print("No recorded frames found, serving synthetic ones")
+        random = np.random.default_rng(0)
+        for _ in range(count):
+            frame = random.integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+            jpegs.append(cv2.imencode('.jpg', frame)[1].tobytes())
+    return jpegs
+
+def apiTimestamp():
+    """Current time in the API's updated_at format, so every listing looks like a fresh frame."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+class FakeLinecam:
+    """Threaded HTTP server imitating the linecam endpoints. latency is added to each image download."""
+
+    def __init__(self, jpegs, latency=0.0, host='127.0.0.1', port=0):
+        self.jpegs = jpegs
+        self.latency = latency
+        self.layouts = {}
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, count):
+        """API base URL serving count simulated cameras."""
+        if count not in self.layouts:
+            buildings = {}
+            for building, location, camera_id in cameraLayout(count):
+                buildings.setdefault(building, []).append((location, camera_id))
+            self.layouts[count] = buildings
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/cameras/{count}"
+
+    def listing(self, count, building):
+        base = self.url(count)
+        updated_at = apiTimestamp()
+        return [{'id': camera_id, 'description': location, 'updated_at': updated_at,
+                 'url': f"{base}/frames/{camera_id}.jpg"}
+                for location, camera_id in self.layouts[count].get(building, [])]
+
+    def handler(self):
+        linecam = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                request = urlparse(self.path)
+                parts = request.path.strip('/').split('/')
+                if len(parts) < 3 or parts[0] != 'cameras' or int(parts[1]) not in linecam.layouts:
+                    self.send_error(404)
+                    return
+                count = int(parts[1])
+                if parts[2] == 'locations':
+                    self.reply(json.dumps(list(linecam.layouts[count])).encode(), 'application/json')
+                elif parts[2] == 'images':
+                    building = parse_qs(request.query).get('location', [''])[0]
+                    self.reply(json.dumps(linecam.listing(count, building)).encode(), 'application/json')
+                elif parts[2] == 'frames' and len(parts) == 4:
+                    if linecam.latency:
+                        time.sleep(linecam.latency)
+                    camera_id = int(parts[3].split('.')[0])
+                    self.reply(linecam.jpegs[camera_id % len(linecam.jpegs)], 'image/jpeg')
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
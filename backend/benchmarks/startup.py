@@ -0,0 +1,49 @@
+"""Startup-time benchmark for the API.
+
+Imports app.py in a fresh interpreter several times and reports the median import
+time and whether torch, cv2 or pandas were loaded. CountPeople (the sweep path,
+which the API used to import at startup) is measured alongside for comparison.
+
+Run from backend/:  python benchmarks/startup.py [runs]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['torch', 'cv2', 'pandas']
+TARGETS = {
+    'api': 'import app',
+    'sweep': 'import CountPeople',
+}
+
+SNIPPET = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def measure(statement, runs):
+    times = []
+    heavy = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', SNIPPET.format(statement=statement, heavy=HEAVY_MODULES)],
+                                cwd=BACKEND_DIR, capture_output=True, text=True)
+        if output.returncode != 0:
+            return {'error': output.stderr.strip().splitlines()[-1]}
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    return {'medianSeconds': statistics.median(times), 'runs': runs, 'heavyModules': heavy}
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {name: measure(statement, runs) for name, statement in TARGETS.items()}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
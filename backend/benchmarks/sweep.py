@@ -0,0 +1,228 @@
+"""End-to-end benchmark of the people-counting sweep against a local linecam stand-in.
+
+For each camera count a fresh scratch database is seeded with that many simulated
+cameras, served by benchmarks/fakelinecam.py from recorded JPEGs. Each size then runs:
+
+  - a cold sweep (empty frame cache, every frame goes through the detector pool),
+  - a cached sweep (same frames again, so the frame cache skips inference),
+  - a stage pass over up to --stage-frames cameras that times fetch, decode,
+    inference, annotate, encode and the DB write one at a time.
+
+Record frames for --images by running a real sweep with SAVE_INPUT_IMAGES on;
+without them synthetic frames are served. Results are JSON, keyed by camera count,
+and include the git commit so runs of different versions can be compared.
+
+Run from backend/:
+    python benchmarks/sweep.py [--cameras 10 100 1000] [--images input_images]
+        [--latency 0] [--stage-frames 100] [--output sweep.json] [--verbose]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+STAGES = ['fetch', 'decode', 'inference', 'annotate', 'encode', 'dbWrite']
+
+def summarize(seconds):
+    """Latency summary of a list of per-item timings."""
+    if not seconds:
+        return {'count': 0}
+    ordered = sorted(seconds)
+    return {
+        'count': len(ordered),
+        'totalSeconds': sum(ordered),
+        'meanMs': statistics.mean(ordered) * 1000,
+        'p50Ms': ordered[len(ordered) // 2] * 1000,
+        'p95Ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+    }
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def seedDatabase(count):
+    """Create the schema in the scratch database.db and add count simulated cameras."""
+    from datetime import datetime
+    from Core import db, Location, Camera, LocationSnapshot
+    from Analytics import Analytics, Frames, HourlyAnalytics, DailyAnalytics
+    from fakelinecam import cameraLayout
+
+    layout = cameraLayout(count)
+    with db.connection_context():
+        db.create_tables([Location, Camera, LocationSnapshot, Analytics, Frames, HourlyAnalytics, DailyAnalytics])
+        with db.atomic():
+            locations = {location: building for building, location, _ in layout}
+            Location.insert_many([{'name': name, 'building': building, 'longitude': '0', 'latitude': '0',
+                                   'trafficLevel': 'empty'} for name, building in locations.items()]).execute()
+            Camera.insert_many([{'cameraId': camera_id, 'name': location, 'locationName': location,
+                                 'timestamp': datetime.utcnow(), 'image': ''}
+                                for _, location, camera_id in layout]).execute()
+
+def timedSweep(process_locations):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        stats = process_locations()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def measureStages(frames):
+    """Run each pipeline stage on its own over the first frames cameras and time it."""
+    import cv2
+    import numpy as np
+    from Core import createSession
+    from Fetch import fetch_cameras
+    from Detect import personBoxes, annotate, BATCH_SIZE, PERSON_CLASS, DETECT_THRESHOLD
+    from Backends import createDetector
+    from SweepWriter import SweepWriter
+    from CountPeople import get_locations, image_prefix
+    from ImageStore import image_store
+
+    timings = {stage: [] for stage in STAGES}
+    cameras = fetch_cameras([location.building for location in get_locations()])
+    session = createSession(1)
+    images = []
+    for camera in cameras[:frames]:
+        start = time.perf_counter()
+        content = session.get(camera['url']).content
+        timings['fetch'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        images.append(cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR))
+        timings['decode'].append(time.perf_counter() - start)
+
+    # The detector is timed per batch, as the sweep runs it, and spread over the frames in it
+    detector = createDetector()
+    detector.predict(images[:BATCH_SIZE], classes=[PERSON_CLASS], confidence=DETECT_THRESHOLD)
+    boxes = []
+    for offset in range(0, len(images), BATCH_SIZE):
+        chunk = images[offset:offset + BATCH_SIZE]
+        start = time.perf_counter()
+        predictions = detector.predict(chunk, classes=[PERSON_CLASS], confidence=DETECT_THRESHOLD)
+        boxes.extend(personBoxes(prediction, image, DETECT_THRESHOLD) for prediction, image in zip(predictions, chunk))
+        timings['inference'].extend([(time.perf_counter() - start) / len(chunk)] * len(chunk))
+
+    names = {}
+    for camera, image, found in zip(cameras, images, boxes):
+        start = time.perf_counter()
+        annotate(image, found)
+        timings['annotate'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        names[camera['id']] = image_store.save(image_prefix(camera), image)
+        timings['encode'].append(time.perf_counter() - start)
+
+    # The write covers every camera, since its cost grows with the sweep rather than per frame
+    writer = SweepWriter()
+    for camera in cameras:
+        writer.add({'id': camera['id'], 'timestamp': camera['updated_at'], 'peopleCount': 1})
+        if camera['id'] in names:
+            writer.image(camera['id'], names[camera['id']])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        timings['dbWrite'].append(writer.commit()['commitSeconds'])
+    return {stage: summarize(seconds) for stage, seconds in timings.items()}
+
+def child(count, stage_frames, result_path):
+    """Benchmark one camera count. Runs with a scratch directory as cwd and LINECAM_API_URL set."""
+    import numpy as np
+    seedDatabase(count)
+    import CountPeople
+    from FrameCache import frame_cache
+    from Detect import DETECT_THRESHOLD
+
+    # Start the detector workers and load their models outside the timed sweeps
+    warmup = time.perf_counter()
+    CountPeople.detector.detect([np.zeros((480, 640, 3), dtype=np.uint8)], DETECT_THRESHOLD)
+    warmup = time.perf_counter() - warmup
+
+    cold = timedSweep(CountPeople.process_locations)
+    cold['frameCache'] = frame_cache.stats()
+    frame_cache.hits = frame_cache.misses = 0
+    cached = timedSweep(CountPeople.process_locations)
+    cached['frameCache'] = frame_cache.stats()
+    CountPeople.detector.close()
+
+    result = {
+        'cameras': count,
+        'detectorWarmupSeconds': warmup,
+        'coldSweep': cold,
+        'cachedSweep': cached,
+        'camerasPerSecond': count / cold['seconds'],
+        'stages': measureStages(stage_frames),
+    }
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--images', default=os.path.join(BACKEND_DIR, 'input_images'),
+                        help='directory of recorded camera JPEGs')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every image download')
+    parser.add_argument('--stage-frames', type=int, default=100, help='cameras timed stage by stage')
+    parser.add_argument('--output')
+    parser.add_argument('--verbose', action='store_true', help='show the output of each benchmark run')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.stage_frames, args.result)
+        return
+
+    from fakelinecam import FakeLinecam, loadJpegs
+    from Backends import DETECT_BACKEND, INPUT_SIZE
+    from DetectService import DETECT_WORKERS
+    from Detect import BATCH_SIZE
+    from Fetch import FETCH_WORKERS
+
+    jpegs = loadJpegs(args.images)
+    server = FakeLinecam(jpegs, latency=args.latency / 1000)
+    results = {
+        'commit': gitCommit(),
+        'backend': DETECT_BACKEND,
+        'inputSize': INPUT_SIZE,
+        'batch': BATCH_SIZE,
+        'detectWorkers': DETECT_WORKERS,
+        'fetchWorkers': FETCH_WORKERS,
+        'recordedImages': len(jpegs),
+        'latencyMs': args.latency,
+        'sweeps': {},
+    }
+    for count in args.cameras:
+        with tempfile.TemporaryDirectory() as scratch:
+            result_path = os.path.join(scratch, 'result.json')
+            env = dict(os.environ, LINECAM_API_URL=server.url(count))
+            run = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(count),
+                                  '--stage-frames', str(args.stage_frames), '--result', result_path],
+                                 cwd=scratch, env=env, stderr=subprocess.PIPE, text=True,
+                                 stdout=None if args.verbose else subprocess.DEVNULL)
+            if run.returncode != 0 or not os.path.exists(result_path):
+                error = run.stderr.strip().splitlines()
+                results['sweeps'][count] = {'error': error[-1] if error else f"exit code {run.returncode}"}
+                print(f"{count} cameras: failed")
+                continue
+            with open(result_path) as f:
+                results['sweeps'][count] = json.load(f)
+        sweep = results['sweeps'][count]
+        print(f"{count} cameras: {sweep['coldSweep']['seconds']:.2f}s cold, "
+              f"{sweep['cachedSweep']['seconds']:.2f}s cached, {sweep['camerasPerSecond']:.1f} cameras/s")
+    server.close()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()